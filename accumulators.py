@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:45:57 2026
+
+@author:rday
+
+Streaming averages for the points of a temperature program. running_stats
+keeps the mean and variance of a stream of readings with Welford's update,
+without storing the readings, and optionally rejects outliers as they
+arrive. Readings of a slowly drifting or filtered signal are correlated, so
+the naive standard error std/sqrt(n) is too small: the lag-1 autocorrelation
+is accumulated as well, and the standard error is corrected for the
+effective number of independent readings.
+
+"""
+
+import numpy as np
+
+
+def _t_quantile(z,dof):
+    '''
+    Quantile of Student's t with dof degrees of freedom at the normal
+    quantile z (Cornish-Fisher expansion), i.e. how much further out a
+    scatter estimated from few readings puts the same tail probability.
+    '''
+    return z+(z**3+z)/(4.0*dof)+(5.0*z**5+16.0*z**3+3.0*z)/(96.0*dof**2)
+
+
+class running_stats:
+
+    def __init__(self,reject=None,min_count=5,robust=20):
+        '''
+        args:
+            reject -- float, optional: discard a reading more than this many
+            standard deviations from the running mean. The limit is widened
+            while the scatter is known from few readings, so that good
+            readings are rejected at the rate a normal distribution gives.
+            min_count -- int readings seen before rejection starts
+            robust -- int readings over which the median and MAD of the
+            readings seen so far are used, rather than the mean and standard
+            deviation of those accepted, so that an early outlier cannot
+            spoil the estimate
+        '''
+        self.reject = reject
+        self.min_count = min_count
+        self.robust = robust
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.rejected = 0
+        self._mean = 0.0
+        self._M2 = 0.0
+        self.shift = None
+        self.previous = None
+        # First readings offered, for the robust early estimate
+        self.early = []
+        # Sums over successive pairs, for the lag-1 autocovariance
+        self.pairs = 0
+        self.Sx = self.Sy = self.Sxy = 0.0
+
+    def add(self,value):
+        '''
+        Add a reading.
+        return:
+            bool, False if the reading was rejected as an outlier
+        '''
+        if self.shift is None:
+            # Pairs are summed about the first reading, to limit cancellation
+            self.shift = value
+        x = value-self.shift
+        if self.reject is not None and self._outlier(x):
+            self.rejected += 1
+            return False
+        self.count += 1
+        delta = x-self._mean
+        self._mean += delta/self.count
+        self._M2 += delta*(x-self._mean)
+        if self.previous is not None:
+            self.pairs += 1
+            self.Sx += self.previous
+            self.Sy += x
+            self.Sxy += self.previous*x
+        self.previous = x
+        return True
+
+    def _outlier(self,x):
+        seen = len(self.early)
+        if seen<self.robust:
+            self.early.append(x)
+        if seen<self.min_count:
+            return False
+        if seen<self.robust:
+            # The MAD is only ~37% as efficient as the standard deviation
+            centre = np.median(self.early[:-1])
+            scale = 1.4826*np.median(np.abs(np.array(self.early[:-1])-centre))
+            dof = 0.37*(seen-1)
+        else:
+            centre,scale,dof = self._mean,np.sqrt(self._M2/(self.count-1)),self.count-1
+        limit = _t_quantile(self.reject,max(dof,1.0))*np.sqrt(1.0+1.0/seen)*scale
+        return scale>0 and abs(x-centre)>limit
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def mean(self):
+        return self.shift+self._mean if self.count else np.nan
+
+    @property
+    def variance(self):
+        return self._M2/(self.count-1) if self.count>1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance) if self.count>1 else np.nan
+
+    @property
+    def sem(self):
+        '''
+        Naive standard error of the mean, std/sqrt(n).
+        '''
+        return self.std/np.sqrt(self.count) if self.count>1 else np.nan
+
+    @property
+    def autocorrelation(self):
+        '''
+        Lag-1 autocorrelation of the accepted readings.
+        '''
+        if self.pairs<2 or not self._M2>0:
+            return 0.0
+        covariance = (self.Sxy-self.Sx*self.Sy/self.pairs)/self.pairs
+        return float(np.clip(covariance/(self._M2/self.count),-0.99,0.99))
+
+    @property
+    def effective_count(self):
+        '''
+        Number of independent readings the correlated readings are worth, for
+        an AR(1) process: n*(1-rho)/(1+rho), with rho the lag-1
+        autocorrelation (taken as 0 when negative).
+        '''
+        rho = max(self.autocorrelation,0.0)
+        return self.count*(1.0-rho)/(1.0+rho)
+
+    @property
+    def error(self):
+        '''
+        Standard error of the mean, corrected for autocorrelation.
+        '''
+        if self.count<2:
+            return np.nan
+        return self.std/np.sqrt(max(self.effective_count,1.0))
+
+    def summary(self):
+        return {'mean':self.mean,
+                'std':self.std,
+                'sem':self.sem,
+                'error':self.error,
+                'count':self.count,
+                'rejected':self.rejected,
+                'autocorrelation':self.autocorrelation}
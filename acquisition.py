@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:32:47 2026
+
+@author:rday
+
+Concurrent instrument reads. Each instrument gets its own worker thread, so
+one acquisition tick costs about as long as the slowest instrument rather
+than the sum of all of them. A sampler thread runs the ticks on a fixed
+schedule and hands the samples to the GUI (or any other consumer) through a
+queue, so that slow plotting or disk access never delays a measurement.
+
+"""
+
+import contextlib
+import time
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class _countdown:
+
+    def __init__(self,count):
+        self.count = count
+        self.condition = threading.Condition()
+
+    def arrive(self):
+        with self.condition:
+            self.count -= 1
+            if self.count<=0:
+                self.condition.notify_all()
+
+    def wait(self,timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.count<=0,timeout)
+
+
+class acquisition_engine:
+
+    def __init__(self,readers,timeout=5.0):
+        '''
+        args:
+            readers -- dict of name to callable taking no arguments, e.g.
+            {'T':lakeshore._measure_T,'Vr':voltmeter._do_acv_measure}, or to a
+            (request,fetch) pair of such callables for a split read, e.g.
+            (voltmeter._start_acv,voltmeter._fetch_reading). Every request of
+            a tick is sent before any fetch, so that instruments sharing a bus
+            measure at the same time rather than one after another.
+            timeout -- float seconds allowed for each read, or a dict of
+            name to seconds
+        '''
+        self.readers = dict(readers)
+        if isinstance(timeout,dict):
+            self.timeout = dict(timeout)
+        else:
+            self.timeout = {name:timeout for name in self.readers}
+        self.workers = {name:ThreadPoolExecutor(max_workers=1,thread_name_prefix='read-{:s}'.format(name)) for name in self.readers}
+        # name to (tick,future) of the reads still in progress
+        self.pending = {}
+        self.ticks = 0
+
+    def _timed(self,name,requested,deadline):
+        start = time.time()
+        reader = self.readers[name]
+        if isinstance(reader,tuple):
+            request,fetch = reader
+            try:
+                request()
+            finally:
+                requested.arrive()
+            requested.wait(max(deadline-time.time(),0.0))
+            value = fetch()
+        else:
+            requested.arrive()
+            value = reader()
+        return value,start,time.time()
+
+    def sample(self):
+        '''
+        Read every instrument at once and collect the results.
+        return:
+            dict with
+            'time' -- float epoch seconds, the mean of the read midpoints
+            'values' -- dict of name to value (None if the read failed)
+            'latency' -- dict of name to seconds taken by the read
+            'spread' -- float seconds between the earliest and latest read
+            midpoints, a measure of how well the reads were synchronized
+            'errors' -- dict of name to the exception raised, for failed reads
+            'duration' -- float seconds spent waiting for the instruments
+            An instrument whose last read timed out is not queried again until
+            that read returns, and the late result is thrown away rather than
+            paired with the readings of a later tick.
+        '''
+        start = time.time()
+        self.ticks += 1
+        for name,(tick,future) in list(self.pending.items()):
+            if future.done():
+                del self.pending[name]
+        submit = [name for name in self.readers if name not in self.pending]
+        requested = _countdown(len(submit))
+        deadline = start+min(self.timeout.values())
+        for name in submit:
+            self.pending[name] = (self.ticks,self.workers[name].submit(self._timed,name,requested,deadline))
+        values,latency,midpoints,errors = {},{},{},{}
+        for name in self.readers:
+            tick,future = self.pending[name]
+            if tick!=self.ticks:
+                values[name] = None
+                errors[name] = TimeoutError('{:s} read of an earlier tick still in progress'.format(name))
+                continue
+            remaining = start+self.timeout[name]-time.time()
+            try:
+                value,t0,t1 = future.result(timeout=max(remaining,0.0))
+            except FutureTimeout:
+                values[name] = None
+                errors[name] = TimeoutError('{:s} read timed out after {:0.03f} s'.format(name,self.timeout[name]))
+                continue
+            except Exception as err:
+                values[name] = None
+                errors[name] = err
+                del self.pending[name]
+                continue
+            del self.pending[name]
+            values[name] = value
+            latency[name] = t1-t0
+            midpoints[name] = 0.5*(t0+t1)
+        if midpoints:
+            stamp = sum(midpoints.values())/len(midpoints)
+            spread = max(midpoints.values())-min(midpoints.values())
+        else:
+            stamp,spread = start,0.0
+        return {'time':stamp,'values':values,'latency':latency,'spread':spread,'errors':errors,
+                'duration':time.time()-start}
+
+    def close(self):
+        '''
+        Stop the worker threads, without waiting for reads still in progress.
+        '''
+        for worker in self.workers.values():
+            worker.shutdown(wait=False)
+
+
+class sampler:
+
+    def __init__(self,engine,interval,samples=None):
+        '''
+        Producer thread taking a sample from engine every interval seconds.
+        The schedule is drift-free: tick k is due at start + k*interval, however
+        long the reads take. If a tick overruns the next slot, the missed slots
+        are skipped (and counted in self.missed) rather than run late.
+        args:
+            engine -- acquisition_engine
+            interval -- float seconds between samples
+            samples -- queue.Queue receiving the sample dicts (see
+            acquisition_engine.sample, with an added 'tick' number), default
+            a new queue
+        '''
+        self.engine = engine
+        self.interval = interval
+        self.samples = queue.Queue() if samples is None else samples
+        self.missed = 0
+        self.thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self.missed = 0
+        self.thread = threading.Thread(target=self._run,name='sampler',daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        start = time.monotonic()
+        tick = 1
+        while not self._stop.wait(max(0.0,start+tick*self.interval-time.monotonic())):
+            sample = self.engine.sample()
+            sample['tick'] = tick
+            self.samples.put(sample)
+            tick += 1
+            behind = int((time.monotonic()-start)/self.interval)-tick+1
+            if behind>0:
+                self.missed += behind
+                tick += behind
+
+    def stop(self,timeout=None):
+        '''
+        Stop sampling, waiting up to timeout seconds for a tick in progress.
+        '''
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+
+
+class tick_timer:
+
+    def __init__(self,phases=('instrument','compute','disk','redraw')):
+        '''
+        Breakdown of where the time of an acquisition loop goes. Time spent in
+        each phase is added with phase() or add(), and tick() counts the ticks,
+        so that summary() gives the mean seconds per tick in each phase. Safe
+        to use from several threads.
+        args:
+            phases -- list of str phase names, in the order they are reported
+        '''
+        self.phases = list(phases)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = {name:0.0 for name in self.phases}
+            self.ticks = 0
+
+    @contextlib.contextmanager
+    def phase(self,name):
+        '''
+        Context manager adding the time spent in its block to phase name.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name,time.perf_counter()-start)
+
+    def add(self,name,seconds):
+        with self.lock:
+            self.totals[name] = self.totals.get(name,0.0)+seconds
+
+    def tick(self,count=1):
+        with self.lock:
+            self.ticks += count
+
+    def summary(self):
+        '''
+        Dict of phase name to mean seconds per tick.
+        '''
+        with self.lock:
+            ticks = max(self.ticks,1)
+            return {name:total/ticks for name,total in self.totals.items()}
+
+    def report(self):
+        '''
+        One line, e.g. '120 ticks: instrument 310.2 ms | compute 0.1 ms | ...'
+        '''
+        phases = ' | '.join('{:s} {:0.1f} ms'.format(name,1e3*mean) for name,mean in self.summary().items())
+        return '{:d} ticks: {:s}'.format(self.ticks,phases)
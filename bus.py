@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:40:54 2026
+
+@author:rday
+
+Scheduling and instrumentation of the GPIB bus. Every transaction of the
+machines drivers runs through the bus_arbiter of its bus, which executes them
+one at a time from a priority queue, so that threads sharing a GPIB port
+cannot interleave their queries. Temperature-control reads go ahead of bulk
+resistance reads, and a query already waiting in the queue is shared by any
+other thread asking the same question, rather than sent twice.
+
+On the way, bus_stats records a latency histogram for every instrument and
+command, with counts of timeouts, errors and retries, and each arbiter keeps
+the fraction of time its bus is busy.
+
+"""
+
+import heapq
+import itertools
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+PRIORITY_CONTROL = 0
+PRIORITY_BULK = 1
+
+# Latency histogram bins (s): 10 per decade from 100 us to 100 s, plus an
+# underflow and an overflow bin
+HISTOGRAM_EDGES = np.logspace(-4,2,61)
+
+_ARGUMENT = re.compile(r'(?<=[ ,])[-+]?[\d.]+(?:[eE][-+]?\d+)?')
+
+
+def bus_name(address):
+    '''
+    Interface board of a VISA address, e.g. GPIB0 for GPIB0::9::INSTR. A
+    GPIB address without a board number is on board 0.
+    '''
+    board = address.split('::')[0].upper()
+    return 'GPIB0' if board=='GPIB' else board
+
+
+def command_key(command):
+    '''
+    Command with its numeric arguments replaced by #, so that e.g.
+    'FREQ 27.200' and 'FREQ 13.000' share a histogram, while 'KRDG? A' and
+    'KRDG? B' do not.
+    '''
+    return _ARGUMENT.sub('#',command.strip())
+
+
+def is_timeout(err):
+    return isinstance(err,TimeoutError) or 'timeout' in str(err).lower()
+
+
+class bus_stats:
+
+    def __init__(self,edges=HISTOGRAM_EDGES):
+        '''
+        Thread-safe latency and failure counts, keyed by instrument address
+        and command.
+        args:
+            edges -- array of histogram bin edges (s)
+        '''
+        self.edges = np.asarray(edges)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.failures = {}
+
+    def _instrument(self,address):
+        counts = self.failures.get(address)
+        if counts is None:
+            counts = self.failures[address] = {'timeouts':0,'errors':0,'retries':0}
+        return counts
+
+    def record(self,address,command,seconds):
+        '''
+        Add the duration of one transaction.
+        '''
+        key = (address,command_key(command))
+        with self.lock:
+            entry = self.commands.get(key)
+            if entry is None:
+                entry = self.commands[key] = {'counts':np.zeros(len(self.edges)+1,dtype=int),
+                                              'count':0,'total':0.0,'min':np.inf,'max':0.0}
+            entry['counts'][np.searchsorted(self.edges,seconds)] += 1
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['min'] = min(entry['min'],seconds)
+            entry['max'] = max(entry['max'],seconds)
+
+    def failure(self,address,err):
+        with self.lock:
+            self._instrument(address)['timeouts' if is_timeout(err) else 'errors'] += 1
+
+    def retry(self,address):
+        with self.lock:
+            self._instrument(address)['retries'] += 1
+
+    def _percentile(self,entry,q):
+        '''
+        Upper edge of the histogram bin holding the q quantile (at most the
+        largest latency seen).
+        '''
+        index = int(np.searchsorted(np.cumsum(entry['counts']),q*entry['count']))
+        if index>=len(self.edges):
+            return entry['max']
+        return min(float(self.edges[index]),entry['max'])
+
+    def summary(self):
+        '''
+        Live statistics.
+        return:
+            dict with
+            'commands' -- dict of address to dict of command to a dict of
+            count, mean, min, max, p50, p90 and p99 (s)
+            'instruments' -- dict of address to a dict of count, mean and
+            total (s) over all commands, and the timeouts, errors and retries
+        '''
+        with self.lock:
+            commands,instruments = {},{}
+            for (address,command),entry in sorted(self.commands.items()):
+                commands.setdefault(address,{})[command] = {'count':entry['count'],
+                                                            'mean':entry['total']/entry['count'],
+                                                            'min':entry['min'],
+                                                            'max':entry['max'],
+                                                            'p50':self._percentile(entry,0.5),
+                                                            'p90':self._percentile(entry,0.9),
+                                                            'p99':self._percentile(entry,0.99)}
+                total = instruments.setdefault(address,{'count':0,'total':0.0})
+                total['count'] += entry['count']
+                total['total'] += entry['total']
+            for address,counts in self.failures.items():
+                instruments.setdefault(address,{'count':0,'total':0.0}).update(counts)
+            for total in instruments.values():
+                total['mean'] = total['total']/total['count'] if total['count'] else 0.0
+                for name in ('timeouts','errors','retries'):
+                    total.setdefault(name,0)
+            return {'commands':commands,'instruments':instruments}
+
+    def histograms(self):
+        '''
+        Dict of address to dict of command to list of counts in the bins of
+        self.edges, with an underflow bin first and an overflow bin last.
+        '''
+        with self.lock:
+            histograms = {}
+            for (address,command),entry in sorted(self.commands.items()):
+                histograms.setdefault(address,{})[command] = entry['counts'].tolist()
+            return histograms
+
+    def report(self):
+        '''
+        Printable table of the latency of each instrument and command.
+        '''
+        summary = self.summary()
+        lines = ['{:<22s} {:<28s} {:>7s} {:>9s} {:>9s} {:>9s}'.format('instrument','command','count','mean(ms)','p90(ms)','max(ms)')]
+        for address,commands in summary['commands'].items():
+            for command,entry in commands.items():
+                lines.append('{:<22s} {:<28s} {:>7d} {:>9.2f} {:>9.2f} {:>9.2f}'.format(address,command[:28],entry['count'],
+                                                                                         1e3*entry['mean'],1e3*entry['p90'],1e3*entry['max']))
+        for address,total in summary['instruments'].items():
+            if total['timeouts'] or total['errors'] or total['retries']:
+                lines.append('{:<22s} timeouts {:d}, errors {:d}, retries {:d}'.format(address,total['timeouts'],total['errors'],total['retries']))
+        return '\n'.join(lines)
+
+    def dump(self,fnm,**extra):
+        '''
+        Write the summary and the histograms to fnm as JSON.
+        args:
+            fnm -- str path
+            extra -- further entries for the file, e.g. buses=...
+        '''
+        record = dict(self.summary(),histograms=self.histograms(),edges=self.edges.tolist(),**extra)
+        with open(fnm,'w') as tofile:
+            json.dump(record,tofile,indent=1)
+
+
+class bus_arbiter:
+
+    def __init__(self,name,stats=None):
+        '''
+        Serializes the transactions on one bus. They are executed in order of
+        priority (then of arrival) by a worker thread, which is started with the
+        first transaction and sleeps while the queue is empty.
+        args:
+            name -- str bus name, e.g. GPIB0
+            stats -- bus_stats receiving the latency of every transaction
+        '''
+        self.name = name
+        self.stats = stats
+        self.queue = []
+        self.pending = {}
+        self.order = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.closing = False
+        self.reset()
+
+    def reset(self):
+        '''
+        Restart the busy-fraction and transaction counts.
+        '''
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self.transactions = 0
+        self.coalesced = 0
+
+    def run(self,transaction,label='',priority=PRIORITY_BULK,key=None,address=''):
+        '''
+        Execute transaction() on the bus, and return its result (or raise its
+        exception).
+        args:
+            transaction -- callable taking no arguments
+            label -- str command, for the statistics
+            priority -- int, lower runs first: PRIORITY_CONTROL or PRIORITY_BULK
+            key -- hashable, optional: a transaction with the same key that is
+            still waiting in the queue is shared rather than queued again
+            (use this for queries without side effects)
+            address -- str instrument address, for the statistics
+        '''
+        if threading.current_thread() is self.thread:
+            # Called from inside a transaction: the bus is already ours
+            return transaction()
+        with self.condition:
+            future = self.pending.get(key) if key is not None else None
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = Future()
+                heapq.heappush(self.queue,(priority,next(self.order),future,transaction,label,address,key))
+                if key is not None:
+                    self.pending[key] = future
+                if self.thread is None:
+                    self.closing = False
+                    self.thread = threading.Thread(target=self._worker,name='bus-{:s}'.format(self.name),daemon=True)
+                    self.thread.start()
+                self.condition.notify()
+        return future.result()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closing:
+                    self.condition.wait()
+                if not self.queue:
+                    self.thread = None
+                    return
+                priority,order,future,transaction,label,address,key = heapq.heappop(self.queue)
+                if key is not None and self.pending.get(key) is future:
+                    del self.pending[key]
+            start = time.perf_counter()
+            try:
+                result = transaction()
+            except BaseException as err:
+                elapsed = time.perf_counter()-start
+                if self.stats is not None:
+                    self.stats.failure(address,err)
+                future.set_exception(err)
+            else:
+                elapsed = time.perf_counter()-start
+                if self.stats is not None:
+                    self.stats.record(address,label,elapsed)
+                future.set_result(result)
+            self.busy += elapsed
+            self.transactions += 1
+
+    def busy_fraction(self):
+        '''
+        Fraction of the time since the last reset that the bus spent executing
+        transactions.
+        '''
+        elapsed = time.monotonic()-self.started
+        return self.busy/elapsed if elapsed>0 else 0.0
+
+    def report(self):
+        return {'busy_fraction':self.busy_fraction(),
+                'transactions':self.transactions,
+                'coalesced':self.coalesced,
+                'queued':len(self.queue)}
+
+    def close(self,timeout=None):
+        '''
+        Stop the worker once the queue is empty.
+        '''
+        with self.condition:
+            self.closing = True
+            thread = self.thread
+            self.condition.notify()
+        if thread is not None:
+            thread.join(timeout)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:31:36 2026
+
+@author:rday
+
+Compact column storage for acquisition histories. Each column is a row of a
+preallocated float64 array, which grows geometrically as samples arrive, or
+in ring mode keeps only the most recent samples.
+
+"""
+
+import numpy as np
+
+
+class column_store:
+
+    def __init__(self,keys,capacity=1024,ring=None):
+        '''
+        args:
+            keys -- list of str column names
+            capacity -- int number of rows allocated up front
+            ring -- int, optional: keep only this many of the most recent rows.
+            Each row is then written twice, at i and i+ring, so that the last
+            ring rows are always available as one contiguous view.
+        '''
+        self.keys = list(keys)
+        self.ring = ring
+        self._index = {k:i for i,k in enumerate(self.keys)}
+        self._data = np.zeros((len(self.keys),2*ring if ring else max(1,capacity)))
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count,self.ring) if self.ring else self.count
+
+    def __contains__(self,key):
+        return key in self._index
+
+    def append(self,**values):
+        '''
+        Add one row, given as keyword arguments for every column.
+        '''
+        row = [values[k] for k in self.keys]
+        if self.ring:
+            position = self.count%self.ring
+            self._data[:,position] = row
+            self._data[:,position+self.ring] = row
+        else:
+            if self.count==self._data.shape[1]:
+                self._grow(2*self.count)
+            self._data[:,self.count] = row
+        self.count += 1
+
+    def _grow(self,capacity):
+        data = np.zeros((len(self.keys),capacity))
+        data[:,:self.count] = self._data[:,:self.count]
+        self._data = data
+
+    def _bounds(self):
+        if not self.ring or self.count<=self.ring:
+            return 0,self.count
+        stop = (self.count-1)%self.ring+self.ring+1
+        return stop-self.ring,stop
+
+    def __getitem__(self,key):
+        '''
+        View of the stored values of one column, oldest first. The view is not
+        updated by later appends, so take a fresh one each time it is used.
+        '''
+        start,stop = self._bounds()
+        return self._data[self._index[key],start:stop]
+
+    def arrays(self):
+        '''
+        Dict of views of every column.
+        '''
+        return {k:self[k] for k in self.keys}
+
+    def last(self):
+        '''
+        Dict of the values in the most recent row.
+        '''
+        start,stop = self._bounds()
+        return {k:self._data[i,stop-1] for k,i in self._index.items()}
+
+    def clear(self):
+        self.count = 0
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:28:32 2026
+
+@author:rday
+
+Shape-preserving downsampling of long traces for plotting. There is no point
+handing matplotlib more points than there are pixels across the axes, but a
+naive stride would miss narrow features such as the superconducting
+transition, so the routines here choose points by the shape of the trace.
+
+"""
+
+import numpy as np
+
+
+MAX_POINTS = 2000
+
+
+def minmax_indices(x,y,max_points=MAX_POINTS):
+    '''
+    Indices of the points to keep when drawing the trace (x,y) with at most
+    about max_points points. The trace is cut into buckets of consecutive
+    points, and from each bucket the points holding the minimum and maximum of
+    both x and y are kept, so that the drawn envelope matches the full trace
+    for time series and for parametric plots such as R(T) alike.
+    args:
+        x,y -- array-like of equal length
+        max_points -- int approximate upper limit on the number of points kept
+    return:
+        sorted numpy array of int indices
+    '''
+    x = np.asarray(x,dtype=np.float64)
+    y = np.asarray(y,dtype=np.float64)
+    npts = len(y)
+    if npts<=max_points:
+        return np.arange(npts)
+    nbuckets = max(1,max_points//4)
+    size = int(np.ceil(npts/nbuckets))
+    nfull = npts//size
+    keep = [np.array([0,npts-1])]
+    for values in (x,y):
+        blocks = values[:nfull*size].reshape(nfull,size)
+        offsets = np.arange(nfull)*size
+        keep.append(offsets+np.nanargmin(blocks,axis=1))
+        keep.append(offsets+np.nanargmax(blocks,axis=1))
+        if nfull*size<npts:
+            tail = values[nfull*size:]
+            keep.append(nfull*size+np.array([np.nanargmin(tail),np.nanargmax(tail)]))
+    return np.unique(np.concatenate(keep))
+
+
+def minmax(x,y,max_points=MAX_POINTS):
+    '''
+    Downsample the trace (x,y) by min/max bucketing, see minmax_indices.
+    return:
+        x,y -- numpy arrays of the kept points
+    '''
+    index = minmax_indices(x,y,max_points)
+    return np.asarray(x)[index],np.asarray(y)[index]
+
+
+def lttb(x,y,max_points=MAX_POINTS):
+    '''
+    Largest-Triangle-Three-Buckets downsampling of a time series: from each
+    bucket, keep the point which makes the largest triangle with the point
+    kept from the previous bucket and the mean of the next bucket. This gives
+    a visually faithful trace with exactly max_points points, but assumes x is
+    monotonic.
+    return:
+        x,y -- numpy arrays of the kept points
+    '''
+    x = np.asarray(x,dtype=np.float64)
+    y = np.asarray(y,dtype=np.float64)
+    npts = len(y)
+    if npts<=max_points or max_points<3:
+        return x,y
+    edges = np.linspace(1,npts-1,max_points-1).astype(int)
+    index = np.zeros(max_points,dtype=int)
+    index[-1] = npts-1
+    previous = 0
+    for b in range(max_points-2):
+        lo,hi = edges[b],edges[b+1]
+        nlo,nhi = hi,edges[b+2] if b+2<len(edges) else npts
+        xmean = x[nlo:nhi].mean() if nhi>nlo else x[-1]
+        ymean = y[nlo:nhi].mean() if nhi>nlo else y[-1]
+        area = np.abs((x[previous]-xmean)*(y[lo:hi]-y[previous])-(x[previous]-x[lo:hi])*(ymean-y[previous]))
+        previous = lo+int(np.argmax(area))
+        index[b+1] = previous
+    return x[index],y[index]
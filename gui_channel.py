@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:46:48 2026
+
+@author:rday
+
+Thread-safe channel from worker threads to the GUI thread. Tkinter widgets
+and the matplotlib canvas may only be touched from the Tk thread, so workers
+post their updates here, keyed by what they update, and the GUI applies them
+on its own schedule. An update posted while an earlier one for the same key
+is still waiting replaces it, so each frame only renders the latest state,
+however fast the workers post.
+
+"""
+
+import threading
+
+
+class update_channel:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.posted = 0
+        self.merged = 0
+
+    def post(self,key,value=None):
+        '''
+        Queue an update for key, replacing any update for key not yet taken.
+        args:
+            key -- hashable, e.g. the name of a widget
+            value -- the new state (e.g. a label's text)
+        '''
+        with self.lock:
+            self.posted += 1
+            if key in self.pending:
+                self.merged += 1
+            self.pending[key] = value
+
+    def drain(self):
+        '''
+        Take every waiting update.
+        return:
+            dict of key to latest value, in the order the keys were first posted
+        '''
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        return pending
+
+    def requeue(self,updates):
+        '''
+        Put back updates that could not be applied this frame, unless a newer
+        update for the same key has been posted since.
+        '''
+        with self.lock:
+            for key,value in updates.items():
+                self.pending.setdefault(key,value)
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
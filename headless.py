@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:33:55 2026
+
+@author:rday
+
+Headless resistivity acquisition, for use over SSH, from cron, or for a
+batch of sequential measurements. This uses the same instruments, sampler and
+log format as ubc_resistivity, without importing matplotlib or tkinter.
+
+Usage:
+    python headless.py FeSe_cooldown_04.txt --interval 5 --duration 3600 --sample FeSe
+    python headless.py --config cooldown.json
+    python headless.py test.txt --simulate --interval 0.5 --duration 60
+
+A config file is JSON holding any of the command-line options by their long
+names (e.g. {"output":"run.txt","interval":2.0}). It may instead hold a list
+"runs" of such dicts, which are measured one after another; options outside
+the list apply to every run. Options given on the command line override the
+config file.
+
+"""
+
+import argparse
+import datetime
+import json
+import queue
+import signal
+import sys
+import threading
+
+import machines
+import acquisition
+import logfile
+
+
+DEFAULTS = {'output':'Sample_001.txt',
+            'interval':5.0,
+            'duration':None,
+            'sample':'Sample',
+            'user':'Username',
+            'material':'Material',
+            'Rr':1.0e4,
+            'amplification':1.0e2,
+            'voltmeter':9,
+            'lakeshore':15,
+            'channel':'A',
+            'lockin':8,
+            'freq':27.2,
+            'Vin':1.0,
+            'timeout':5.0,
+            'fsync':'flush',
+            'quiet':False,
+            'simulate':False,
+            'replay':None,
+            'speed':1.0,
+            'stats':None}
+
+
+class headless_run:
+
+    def __init__(self,**options):
+        '''
+        args:
+            options -- any of the keys of DEFAULTS
+        '''
+        unknown = set(options)-set(DEFAULTS)
+        if unknown:
+            raise ValueError('Unknown options: {:s}'.format(', '.join(sorted(unknown))))
+        self.options = dict(DEFAULTS)
+        self.options.update(options)
+        self.stop_event = threading.Event()
+
+    def _V_to_R(self,Vr,Vs):
+        '''
+        Convert a voltage measurement into a resistance
+        args:
+            Vr -- float Voltage reference resistor from multimeter
+            Vs -- float Voltage sample, from lock-in
+        '''
+        return Vs/self.options['amplification']*self.options['Rr']/Vr
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _log_sample(self,writer,start,sample):
+        '''
+        Write one sample from the sampler to the log.
+        return:
+            bool, False if a read failed and the sample was skipped
+        '''
+        if sample['errors']:
+            for name,err in sample['errors'].items():
+                print('WARNING: {:s} read failed: {:s}'.format(name,str(err)),file=sys.stderr)
+            return False
+        Vr = sample['values']['Vr']
+        Vs_x,Vs_y = sample['values']['Vs']
+        Rs = self._V_to_R(Vr,abs(Vs_x+1.0j*Vs_y))
+        seconds = sample['time']-start.timestamp()
+        writer.write_line(seconds,sample['values']['T'],Vr,Vs_x,Vs_y,Rs)
+        if not self.options['quiet']:
+            print('{:0.03f} s  T = {:0.03f} K  R = {:0.05f} Ohm'.format(seconds,sample['values']['T'],Rs))
+        return True
+
+    def run(self):
+        '''
+        Connect to the instruments, and log a sample every interval seconds
+        until the duration has passed or stop() is called.
+        return:
+            int number of samples logged
+        '''
+        opts = self.options
+        if opts['simulate'] or opts['replay']:
+            machines.use_simulator(replay=opts['replay'],speed=opts['speed'])
+        machines.sessions.reset_stats()
+        voltmeter = machines.HP3478A(opts['voltmeter'])
+        lakeshore = machines.LS331(opts['lakeshore'],opts['channel'])
+        lockin = machines.SR850(opts['lockin'],opts['freq'],opts['Vin'])
+        engine = acquisition.acquisition_engine({'T':(lakeshore._request_T,lakeshore._fetch_T),
+                                                 'Vr':(voltmeter._start_acv,voltmeter._fetch_reading),
+                                                 'Vs':(lockin._request_V,lockin._fetch_V)},timeout=opts['timeout'])
+        sampler = acquisition.sampler(engine,opts['interval'])
+        writer = logfile.log_writer(opts['output'],fsync=opts['fsync'])
+        start = datetime.datetime.now()
+        writer.write_header(start,opts['sample'],opts['user'],opts['material'])
+        logged = 0
+        try:
+            sampler.start()
+            while not self.stop_event.is_set():
+                elapsed = (datetime.datetime.now()-start).total_seconds()
+                if opts['duration'] is not None and elapsed>=opts['duration']:
+                    break
+                try:
+                    sample = sampler.samples.get(timeout=min(1.0,opts['interval']))
+                except queue.Empty:
+                    continue
+                logged += self._log_sample(writer,start,sample)
+        finally:
+            sampler.stop()
+            # Log the samples still queued when the run ended
+            while True:
+                try:
+                    sample = sampler.samples.get_nowait()
+                except queue.Empty:
+                    break
+                logged += self._log_sample(writer,start,sample)
+            engine.close()
+            writer.close()
+            for device in (lakeshore,voltmeter,lockin):
+                device._disconnect()
+            if opts['stats']:
+                machines.sessions.dump_stats(opts['stats'])
+            if not opts['quiet']:
+                print(machines.sessions.stats.report())
+        return logged
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Headless UBC resistivity acquisition.')
+    parser.add_argument('output',nargs='?',help='log file to write')
+    parser.add_argument('--config',help='JSON file of options, or of a list of "runs"')
+    parser.add_argument('--interval',type=float,help='seconds between samples (default 5)')
+    parser.add_argument('--duration',type=float,help='seconds to run for (default: until interrupted)')
+    parser.add_argument('--sample')
+    parser.add_argument('--user')
+    parser.add_argument('--material')
+    parser.add_argument('--Rr',type=float,help='reference resistor (Ohm)')
+    parser.add_argument('--amplification',type=float,help='sample voltage pre-amplifier gain')
+    parser.add_argument('--voltmeter',type=int,help='HP3478A GPIB address')
+    parser.add_argument('--lakeshore',type=int,help='LS331 GPIB address')
+    parser.add_argument('--channel',help='LS331 thermometer channel')
+    parser.add_argument('--lockin',type=int,help='SR850 GPIB address')
+    parser.add_argument('--freq',type=float,help='lock-in reference frequency (Hz)')
+    parser.add_argument('--Vin',type=float,help='lock-in sine output amplitude (V)')
+    parser.add_argument('--timeout',type=float,help='seconds allowed for each instrument read')
+    parser.add_argument('--fsync',choices=logfile.FSYNC_POLICIES,help='log crash-safety policy')
+    parser.add_argument('--quiet',action='store_true',default=None,help='do not print each sample')
+    parser.add_argument('--simulate',action='store_true',default=None,help='use the simulated instruments in sim_machines')
+    parser.add_argument('--replay',help='simulate by replaying this log file')
+    parser.add_argument('--speed',type=float,help='simulated seconds per real second')
+    parser.add_argument('--stats',help='write bus latency statistics to this JSON file at the end of the run')
+    return parser.parse_args(argv)
+
+
+def build_runs(args):
+    '''
+    Combine the config file and command-line options into a list of option
+    dicts, one per run.
+    '''
+    config = {}
+    if args.config:
+        with open(args.config,'r') as fromf:
+            config = json.load(fromf)
+    runs = config.pop('runs',[{}])
+    cli = {k:v for k,v in vars(args).items() if v is not None and k!='config'}
+    return [dict(config,**dict(run,**cli)) for run in runs]
+
+
+def main(argv=None):
+    runs = build_runs(parse_args(argv))
+
+    def _terminate(signum,frame):
+        # Unwind through headless_run.run, which closes the log and the
+        # instruments on the way out.
+        raise SystemExit(1)
+
+    signal.signal(signal.SIGTERM,_terminate)
+    for options in runs:
+        run = headless_run(**options)
+        try:
+            logged = run.run()
+        except KeyboardInterrupt:
+            print('Interrupted.',file=sys.stderr)
+            return 1
+        print('Logged {:d} samples to {:s}'.format(logged,run.options['output']))
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main())
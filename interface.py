@@ -12,10 +12,16 @@ import tkinter as Tk
 from tkinter import filedialog
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-from threading import Thread
-from queue import Queue
+from threading import Thread,Condition,Event
+from collections import deque
 import time
 
+from acquisition import tick_timer
+import program
+from stability import stability_detector
+from accumulators import running_stats
+from gui_channel import update_channel
+
 
 
 
@@ -43,12 +49,23 @@ class interface:
         
         
     '''
-    def __init__(self):
+    def __init__(self,temperature_program=None):
+        '''
+        args:
+            temperature_program -- program.temperature_program, optional:
+            a sequence of ramps, dwells and measurement points to run in
+            place of the single setpoint (also loaded with the Program button)
+        '''
         self.running = False
-        self.run_temp = False
+        self.program = temperature_program
+        self.step = None
         self.dwell = False
         self.acquiring = False
-        self.queue = Queue()
+        self.updates = update_channel()
+        self.frame_interval = 100
+        self.frame_budget = 0.05
+        self.frame_id = None
+        self.frame_times = deque(maxlen=1000)
         self.tempnow = 300.0
         self.setnow = 300.0
         self.rate = 1.0
@@ -56,15 +73,34 @@ class interface:
         
         self.Tsample = []
         self.Rsample = []
+        self.Terror = []
+        self.Rerror = []
         self.Rref = []
+        self.reject = None
+        self.Tmeasurement = running_stats()
+        self.Rmeasurement = running_stats()
         self.time_record = []
         
         self.temp_tol = 0.5
+        # Closeness tolerance of the current step: at most half the step, so
+        # that closely spaced points are not taken at the previous temperature
+        self.close_tol = self.temp_tol
         self.stable_tol = 2.0
+        # The window is sized against the fixed dwell it replaces, so that the
+        # readings it needs (min_span of the window) take half that dwell
+        self.stability = stability_detector(window=self.stable_tol,slope_tol=0.05,noise_tol=0.05,temp_tol=self.temp_tol)
+        self.dwell_times = []
         self.dwell_time = 0.0
         self.measure_time = 0.0
         
         self.cycle = 'Idle'
+        self.T_timing = tick_timer()
+        self.R_timing = tick_timer()
+        
+        self.state = Condition()
+        self.shutdown = Event()
+        self.state_changed = time.perf_counter()
+        self.wake_latency = {'temperature':deque(maxlen=1000),'resistance':deque(maxlen=1000)}
         self.window_make()
         
                                     
@@ -77,42 +113,76 @@ class interface:
         
     def initialize_timekeeper(self):
         '''
-        Set the timekeeper thread running. This can only be started once,
-        and the boolean flags required to safely exit this thread upon 
-        closing the interface are defined here as well.
+        Set the timekeeper thread running. This can only be started once;
+        it runs until self.shutdown is set.
         '''
-        self.run_timer  = True
-        self.stop_timer = False
         self.timethread = Thread(target = self.time_update)
         self.timethread.setDaemon(True)
         self.timethread.start()
         
     def initialize_thermometer(self):
         '''
-        Set the thermometer thread running. This can only be started once,
-        and the boolean flags required to safely exit this thread upon 
-        closing the interface are defined here as well.
+        Set the thermometer thread running. This can only be started once;
+        it runs until self.shutdown is set.
         '''
         
-        self.run_temp = True
-        self.stop_temp = False
         self.T_thread = Thread(target = self.temp_update)
         self.T_thread.setDaemon(True)
         self.T_thread.start()
         
     def initialize_resistance(self):
         '''
-        Set the resistance thread running. This can only be started once,
-        and the boolean flags required to safely exit this thread upon 
-        closing the interface are defined here as well.
+        Set the resistance thread running. This can only be started once;
+        it runs until self.shutdown is set.
         '''
         
-        self.run_res = True
-        self.stop_res = False
         self.R_thread = Thread(target = self.res_update)
         self.R_thread.setDaemon(True)
         self.R_thread.start()
         
+    def set_state(self,**flags):
+        '''
+        Change the program state flags (running, acquiring) and wake the
+        worker threads waiting on them. All changes to these flags go through
+        here, so that no thread ever has to poll them.
+        '''
+        with self.state:
+            changed = False
+            for name,value in flags.items():
+                if getattr(self,name)!=value:
+                    setattr(self,name,value)
+                    changed = True
+            if changed:
+                self.state_changed = time.perf_counter()
+                self.state.notify_all()
+                
+    def wait_for_state(self,name,ready):
+        '''
+        Block, without using any CPU, until ready() is true or the interface
+        is shutting down. The time from the state change to the thread
+        waking is recorded in self.wake_latency[name].
+        args:
+            name -- str worker name, key of self.wake_latency
+            ready -- callable returning bool, evaluated with self.state held
+        return:
+            bool, False if the thread should exit
+        '''
+        with self.state:
+            if not ready() and not self.shutdown.is_set():
+                self.state.wait_for(lambda: ready() or self.shutdown.is_set())
+                self.wake_latency[name].append(time.perf_counter()-self.state_changed)
+            return not self.shutdown.is_set()
+        
+    def transition_report(self):
+        '''
+        Mean and worst time for the workers to wake up after a state change.
+        '''
+        lines = []
+        for name,latency in self.wake_latency.items():
+            if latency:
+                lines.append('{:s} wake-up: {:d} transitions, mean {:0.3f} ms, max {:0.3f} ms'.format(
+                    name,len(latency),1e3*np.mean(latency),1e3*np.max(latency)))
+        return '\n'.join(lines)
         
     def time_update(self):
         '''
@@ -120,57 +190,54 @@ class interface:
         allowing the interface to remain accessible to the user, while the
         counter is being incremented. This timestamp can be referenced by any
         of our other worker-threads, such as the temperature logger, to dictate 
-        when a new job should be submitted to the queue. This is set, by default,
-        to update every 100 ms.
+        when a new job should be submitted to the queue. Between updates the
+        thread sleeps on self.shutdown, so that it exits as soon as it is set.
         '''
-        while self.run_timer:
+        while True:
             tnow = time.time()
             self.time_stamp = tnow
-            self.timestring.set(time.ctime(self.time_stamp))
+            self.updates.post('time',time.ctime(self.time_stamp))
             if self.running:
                 if np.mod(self.time_stamp-self.time_start,5)<1:
-                    self.update_plot()
-            time.sleep(1)
+                    self.updates.post('plot')
             
-            if self.stop_timer:
+            if self.shutdown.wait(1):
                 break
             
     def temp_update(self):
         '''
         Main worker function for the temperature thread--besides the ongoing
         time loop, this function determines the state of progress, using the 
-        logic network of *cycle_update* below. While the daemon is in principle
-        running this function continuously, it only really executes when the 
-        program is in its 'running' mode, i.e. the start button has been pressed.
+        logic network of *cycle_update* below. The thread sleeps on self.state
+        until the program is in its 'running' mode, i.e. the start button has
+        been pressed.
         '''
         
-        while self.run_temp:
+        while self.wait_for_state('temperature',lambda: self.running):
 
-            if self.running:
+            with self.T_timing.phase('instrument'):
                 self.tempnow = self.measure_temp()
+            with self.T_timing.phase('compute'):
                 self.cycle_update()
-                self.tempnow_str.set('Temperature: {:0.03f}'.format(self.tempnow))
-
-            if self.stop_temp:
-                break
+            self.updates.post('temperature','Temperature: {:0.03f}'.format(self.tempnow))
+            self.T_timing.tick()
             
     def res_update(self):
         '''
         Main worker function for the resistance measurement-thread. As with temp_update,
-        this is constantly running, but only actually executes the measurement when we 
+        this sleeps on self.state, and only executes the measurement when we 
         are in acquistion mode, set by *cycle_update*
         '''
         
-        while self.run_res:
+        while self.wait_for_state('resistance',lambda: self.running and self.acquiring):
             
-            if self.running and self.acquiring:
+            with self.R_timing.phase('instrument'):
                 self.resnow = self.measure_R()
-                self.Tmeasurement.append(self.tempnow)
-                self.Rmeasurement.append(self.resnow)
-                print('Resistance: ',self.resnow)
-            
-            if self.stop_res:
-                break
+            with self.R_timing.phase('compute'):
+                self.Tmeasurement.add(self.tempnow)
+                self.Rmeasurement.add(self.resnow)
+            print('Resistance: ',self.resnow)
+            self.R_timing.tick()
         
 ###############################################################################
 ##########################                     ################################
@@ -195,8 +262,8 @@ class interface:
             print('WARNING: MUST ENTER A NUMERIC INTEGRATION TIME!')
             
         
-        self.setnow_str.set('Setpoint: {:0.03f} K'.format(self.setnow))
-        self.tempnow_str.set('Temperature: {:0.03f} K'.format(self.tempnow))
+        self.updates.post('setpoint','Setpoint: {:0.03f} K'.format(self.setnow))
+        self.updates.post('temperature','Temperature: {:0.03f} K'.format(self.tempnow))
             
     
     def start_timers(self):
@@ -208,6 +275,9 @@ class interface:
         self.time_start = time.time()
         self.measure_time = 0.0
         self.dwell_time = 0.0
+        self.close_tol = self.stability.temp_tol = self.temp_tol
+        self.stability.reset()
+        self.dwell_times = []
     
     def cycle_run(self):
         
@@ -219,24 +289,37 @@ class interface:
         threads. Outside this operation, the user has access to program controls.
         '''
         
-        self.running = not self.running
-        if self.running:
+        if not self.running:
+            # The run state is set up before the workers are woken, so that
+            # they never see a run with stale timers or program step
             self.start_timers()        
+            self.T_timing.reset()
+            self.R_timing.reset()
                 
             self.update_program()
+            if self.program is not None:
+                self.start_step(self.program.start(self.setnow))
+            self.set_state(running=True)
             self.run_str.set('END')
             self.setpoint_set.config(state = 'disabled')
             self.rate_set.config(state = 'disabled')
             self.integrate_set.config(state = 'disabled')
             self.browse.config(state = 'disabled')
+            self.load_button.config(state = 'disabled')
         else:
+            self.set_state(running=False)
+            print('Temperature loop, {:s}'.format(self.T_timing.report()))
+            print('Resistance loop, {:s}'.format(self.R_timing.report()))
+            print(self.transition_report())
+            print(self.frame_report())
             self.cycle = 'Idle'
-            self.cycle_str.set('Cycle: {:s}'.format(self.cycle))
+            self.updates.post('cycle','Cycle: {:s}'.format(self.cycle))
             self.run_str.set('RUN')
             self.setpoint_set.config(state = 'normal')
             self.rate_set.config(state = 'normal')
             self.integrate_set.config(state = 'normal')
             self.browse.config(state = 'normal')
+            self.load_button.config(state = 'normal')
             
             
 ###############################################################################
@@ -276,14 +359,27 @@ class interface:
         or acquisition state. Once the dwell has been successfuly completed, without 
         ever leaving the safe range, then we initiate acquisition.
         
+        When a temperature program is loaded, each finished step (a ramp
+        reaching its target, a dwell running out, or a point being measured)
+        moves the setpoint on to the next step of the program.
+        
+        Stability is judged by self.stability, from the slope and scatter of
+        the recent readings, so acquisition starts as soon as the temperature
+        has settled rather than after a fixed dwell. The dwell of each point is
+        logged against the fixed dwell of stable_tol seconds.
+        
         '''
         
-            
         if self.running:
-            if abs(self.tempnow-self.setnow)>self.temp_tol:
+            self.stability.add(time.time(),self.tempnow)
+            
+        if self.running and self.program is not None and self.step is None:
+            self.cycle = 'Finished'
+        elif self.running:
+            if abs(self.tempnow-self.setnow)>self.close_tol:
                 
                 self.dwell = False 
-                self.acquiring = False
+                self.set_state(acquiring=False)
                 
                 if self.tempnow>self.setnow:
                     self.cycle = 'Cooling'
@@ -295,48 +391,155 @@ class interface:
                 if not self.dwell:
                     self.dwell_start = self.time_stamp
                     self.dwell = True
+                    self.dwell_time = 0.0
                 else:
                     self.dwell_time = self.time_stamp - self.dwell_start
                     
-                if self.dwell_time<self.stable_tol:
+                if self.step is not None and not self.step['measure']:
+                    if self.dwell_time<self.step['dwell']:
+                        self.cycle = 'Dwelling'
+                    else:
+                        self.start_step(self.program.advance())
+                elif not self.acquiring and not self.stability.settled(self.setnow):
                     self.cycle = 'Stabilizing'
                 else:
                     if not self.acquiring:
+                        self.dwell_times.append(self.dwell_time)
+                        print('Settled at {:0.03f} K: dwell {:0.1f} s vs fixed {:0.1f} s ({:0.1f} s vs {:0.1f} s over {:d} points)'.format(
+                            self.tempnow,self.dwell_time,self.stable_tol,sum(self.dwell_times),self.stable_tol*len(self.dwell_times),len(self.dwell_times)))
                         self.acquire_start = self.time_stamp
-                        self.acquiring = True
-                        self.Tmeasurement = []
-                        self.Rmeasurement = []
+                        # Rejection starts once half the readings expected
+                        # over the integration time are in
+                        period = sum(self.R_timing.summary().values()) or 1.0
+                        min_count = int(np.clip(0.5*self.integrate/period,3,20))
+                        self.Tmeasurement = running_stats(reject=self.reject,min_count=min_count)
+                        self.Rmeasurement = running_stats(reject=self.reject,min_count=min_count)
+                        self.set_state(acquiring=True)
                     self.measure_time = self.time_stamp-self.acquire_start
                     
                     if self.measure_time<self.integrate:
                         self.cycle = 'Acquiring'
                     else:
-                        self.tidy_measurement()
-                        print('change setpoint')
-                        self.cycle = 'Continue'
+                        result = self.tidy_measurement()
+                        if self.program is not None:
+                            self.start_step(self.program.advance(result))
+                        else:
+                            print('change setpoint')
+                            self.cycle = 'Continue'
         else:
             self.cycle = 'Idle'
             
-        self.cycle_str.set('Cycle: {:s}'.format(self.cycle))
+        self.updates.post('cycle','Cycle: {:s}'.format(self.cycle))
+        
+    def start_step(self,step):
+        '''
+        Take the setpoint and rate of the next step of the temperature program,
+        or finish the program if step is None.
+        '''
+        self.step = step
+        self.dwell = False
+        self.dwell_time = 0.0
+        self.stability.reset()
+        self.set_state(acquiring=False)
+        if step is None:
+            print('Program finished: {:d} points measured'.format(len(self.program.results)))
+            self.cycle = 'Finished'
+            return
+        change = abs(step['setpoint']-self.setnow)
+        self.close_tol = min(self.temp_tol,0.5*change) if change>0 else self.temp_tol
+        self.stability.temp_tol = self.close_tol
+        self.setnow = step['setpoint']
+        if step['rate'] is not None:
+            self.rate = step['rate']
+        self.updates.post('setpoint','Setpoint: {:0.03f} K'.format(self.setnow))
+        print('Program: {:s}, setpoint {:0.03f} K'.format(step['segment'],self.setnow))
+        self.cycle = 'Continue'
+        
+    def load_program(self):
+        fnm = filedialog.askopenfilename(title = "Select program",filetypes = (("programs","*.json"),("all files","*.*")))
+        if fnm:
+            self.program = program.load_program(fnm)
+            print('Loaded program: {:s}'.format('; '.join(repr(segment) for segment in self.program.segments)))
         
     def tidy_measurement(self):
+        '''
+        Average the readings of the point just acquired. The readings are
+        accumulated as they arrive by running_stats (Welford), which also
+        gives the error of each average, corrected for the autocorrelation
+        of the readings; set self.reject to a number of standard deviations
+        to discard outliers.
+        return:
+            (T,R) tuple of the averages, or None if nothing was measured
+        '''
+        result = None
         if len(self.Rmeasurement)>0:
 
-            self.T_meas = sum(self.Tmeasurement)/len(self.Tmeasurement)
-            self.R_meas = sum(self.Rmeasurement)/len(self.Rmeasurement) 
+            self.T_meas = self.Tmeasurement.mean
+            self.R_meas = self.Rmeasurement.mean
             self.Tsample.append(self.T_meas)
             self.Rsample.append(self.R_meas)
+            self.Terror.append(self.Tmeasurement.error)
+            self.Rerror.append(self.Rmeasurement.error)
+            print('Point: T = {:0.04f} +/- {:0.04f} K, R = {:0.06g} +/- {:0.02g} Ohm ({:d} readings, {:d} rejected)'.format(
+                self.T_meas,self.Terror[-1],self.R_meas,self.Rerror[-1],len(self.Rmeasurement),self.Rmeasurement.rejected))
             
             self.time_record.append(self.time_stamp)
+            result = (self.T_meas,self.R_meas)
 #            self.update_plot()
-        self.acquiring = False
+        self.set_state(acquiring=False)
         self.dwell = False
+        return result
         
     def update_plot(self):
+        n = min(len(self.time_record),len(self.Rsample))
         self.ax.cla()
-        self.line, = self.ax.plot(self.time_record,self.Rsample)
+        self.line, = self.ax.plot(self.time_record[:n],self.Rsample[:n])
         self.fig.canvas.draw()
         
+    def render(self,key,value):
+        '''
+        Apply one update from the channel. Only ever called on the Tk thread.
+        '''
+        if key=='plot':
+            with self.T_timing.phase('redraw'):
+                self.update_plot()
+        else:
+            {'time':self.timestring,
+             'temperature':self.tempnow_str,
+             'setpoint':self.setnow_str,
+             'cycle':self.cycle_str}[key].set(value)
+        
+    def render_frame(self):
+        '''
+        Tk side of the update channel, run every frame_interval ms: apply the
+        latest value of each update the workers have posted since the last
+        frame, the labels first and the plot last. Once a frame has taken
+        frame_budget seconds, the rest of its updates wait for the next
+        frame, unless superseded by then, so a slow redraw cannot pile up
+        and freeze the interface.
+        '''
+        start = time.perf_counter()
+        updates = self.updates.drain()
+        keys = sorted(updates,key=lambda key: key=='plot')
+        for i,key in enumerate(keys):
+            if time.perf_counter()-start>self.frame_budget:
+                self.updates.requeue({k:updates[k] for k in keys[i:]})
+                break
+            self.render(key,updates[key])
+        if updates:
+            self.frame_times.append(time.perf_counter()-start)
+        if not self.shutdown.is_set():
+            self.frame_id = self.root.after(self.frame_interval,self.render_frame)
+            
+    def frame_report(self):
+        '''
+        Render cost of the GUI frames, and how many updates were merged away.
+        '''
+        if not self.frame_times:
+            return 'GUI: no frames rendered'
+        return 'GUI: {:d} updates posted, {:d} merged, frame mean {:0.1f} ms, max {:0.1f} ms'.format(
+            self.updates.posted,self.updates.merged,1e3*np.mean(self.frame_times),1e3*np.max(self.frame_times))
+        
 ###############################################################################
 ############################              #####################################
 ############################ WINDOW SETUP #####################################
@@ -370,6 +573,9 @@ class interface:
         self.savelabel = Tk.Label(master=self.program_frame,text='Save: ').grid(row=10,column=0,sticky='W',pady=5)
         self.browse = Tk.Button(master=self.program_frame,text='Browse',command=self.browsefile)
         self.browse.grid(row=10,column=2,columnspan=3,sticky='W',ipadx=42,pady=5)
+        self.load_label = Tk.Label(master=self.program_frame,text='Program: ').grid(row=11,column=0,sticky='W',pady=5)
+        self.load_button = Tk.Button(master=self.program_frame,text='Load',command=self.load_program)
+        self.load_button.grid(row=11,column=2,columnspan=3,sticky='W',ipadx=48,pady=5)
             
     
     def make_execute_frame(self):
@@ -407,18 +613,19 @@ class interface:
         '''
         Quit the UI. To safely exit, the timekeeper and all other worker threads must
         safely be terminated, before then finally terminating the UI itself.
+        Setting self.shutdown wakes every waiting thread at once; a thread in
+        the middle of a measurement exits when that measurement returns.
         '''
-        if self.run_timer:
-            self.stop_timer = True
-            self.timethread.join()
-        if self.run_temp:
-            self.stop_temp = True
-            self.T_thread.join()
-        if self.run_res:
-            self.stop_res = True
-            self.R_thread.join()
-        with self.queue.mutex:
-            self.queue.queue.clear()
+        start = time.perf_counter()
+        with self.state:
+            self.shutdown.set()
+            self.state.notify_all()
+        for thread in (self.timethread,self.T_thread,self.R_thread):
+            thread.join(timeout=5.0)
+        print('Worker threads stopped in {:0.03f} s'.format(time.perf_counter()-start))
+        if self.frame_id is not None:
+            self.root.after_cancel(self.frame_id)
+        self.updates.clear()
         self.root.quit()
         self.root.destroy()
         
@@ -461,6 +668,7 @@ class interface:
         
         self.time_label = Tk.Label(master=self.root,textvariable=self.timestring).grid(row=16,column=0,sticky='E',ipadx=20)
 
+        self.frame_id = self.root.after(self.frame_interval,self.render_frame)
         
         Tk.mainloop()
         
@@ -470,4 +678,4 @@ class interface:
 if __name__ == "__main__":
     
     interface()
-        
\ No newline at end of file
+        
\ No newline at end of file
@@ -4,46 +4,562 @@ Created on Tue Feb  5 16:27:19 2019
 
 @author: ARPES08
 """
-import matplotlib.pyplot as plt
 import numpy as np
+import downsample
+import hashlib
+import json
+import os
+import struct
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Map from the column titles written in the log header to the short keys used
+# for data_obj.data. Unknown titles fall back to a lower-case version of the
+# title with the spaces and brackets removed.
+COLUMN_KEYS = {'Time(s)':'time',
+               'Temp(K)':'T',
+               'Temp (Ohm)':'Tr',
+               'Vref(V)':'Vr',
+               'ReVs (mV)':'ReV',
+               'ImVs (mV)':'ImV',
+               'Res(Ohm)':'Rs'}
+
+# Layout assumed for files with no readable column header.
+DEFAULT_KEYS = ['time','T','Tr','Vr','ReV','ImV','Rs']
+
+HEADER_FIELDS = {'Sample Name':'sample','User':'user','Material':'material'}
+
+
+def _column_key(name):
+    name = name.strip()
+    if name in COLUMN_KEYS:
+        return COLUMN_KEYS[name]
+    return ''.join(c for c in name.lower() if c.isalnum())
+
+
+def read_header(fromf):
+    '''
+    Read the header block of a log written by ubc_resistivity, leaving the
+    file positioned at the first data line.
+    args:
+        fromf -- file object opened in binary mode, at the start of the file
+    return:
+        header -- dict with the column 'names' as written, their short 'keys',
+        the byte 'offset' of the first data line, and the 'start' timestamp,
+        'sample', 'user' and 'material' entries where present. 'complete' is
+        False while the file ends inside the header, e.g. in a column line
+        still being written, so that the layout may yet change.
+    '''
+    header = {'names':[],'keys':[],'offset':0,'start':None,'sample':None,'user':None,'material':None,'complete':False}
+    found_columns = False
+    while True:
+        position = fromf.tell()
+        raw = fromf.readline()
+        if not raw:
+            header['offset'] = position
+            break
+        line = raw.decode('latin-1').strip()
+        if found_columns:
+            if line.startswith('='):
+                header['offset'] = fromf.tell()
+                header['complete'] = raw.endswith(b'\n')
+            else:
+                header['offset'] = position
+                header['complete'] = True
+                fromf.seek(position)
+            break
+        if '|' in line:
+            try:
+                float(line.split('|')[0])
+            except ValueError:
+                header['names'] = [n.strip() for n in line.split('|')]
+                header['keys'] = [_column_key(n) for n in header['names']]
+                found_columns = raw.endswith(b'\n')
+                if not found_columns:
+                    header['offset'] = position
+                    break
+                continue
+            header['offset'] = position
+            header['complete'] = True
+            fromf.seek(position)
+            break
+        elif line.startswith('UBC Resistivity Measurement:'):
+            header['start'] = line.split(':',1)[1].strip()
+        elif ':' in line:
+            field,value = line.split(':',1)
+            if field.strip() in HEADER_FIELDS:
+                header[HEADER_FIELDS[field.strip()]] = value.strip()
+    if not header['keys']:
+        header['keys'] = list(DEFAULT_KEYS)
+    return header
+
+
+def parse_block(text,ncol):
+    '''
+    Parse a block of '|'-separated data lines in bulk.
+    args:
+        text -- str of complete data lines
+        ncol -- int number of columns expected on each line
+    return:
+        numpy array of float64, shape (nrows,ncol)
+    '''
+    values = text.replace('|',' ').split()
+    if len(values)%ncol==0 and text.count('|')==(len(values)//ncol)*(ncol-1):
+        try:
+            return np.array(values,dtype=np.float64).reshape(-1,ncol)
+        except ValueError:
+            pass
+    # Fall back to line-by-line for blocks with blank, partial or text lines,
+    # skipping anything that is not a full numeric row (as the old parser did).
+    rows = []
+    for line in text.splitlines():
+        fields = line.split('|')
+        if len(fields)!=ncol:
+            continue
+        try:
+            rows.append([float(f) for f in fields])
+        except ValueError:
+            continue
+    return np.array(rows,dtype=np.float64).reshape(-1,ncol)
+
+
+def columns_from_array(table,keys):
+    '''
+    Split a (nrows,ncol) array into a dict of contiguous float64 columns.
+    '''
+    table = np.ascontiguousarray(table.T)
+    return {k:table[i] for i,k in enumerate(keys)}
+
+
+def parse_file(fnm):
+    '''
+    Parse a full log file.
+    args:
+        fnm -- str path to log file
+    return:
+        header -- dict, as returned by read_header
+        data -- dict of float64 numpy arrays, one per column
+    '''
+    with open(fnm,'rb') as fromf:
+        header = read_header(fromf)
+        text = fromf.read().decode('latin-1')
+    table = parse_block(text,len(header['keys']))
+    return header,columns_from_array(table,header['keys'])
+
+
+def iter_chunks(fnm,chunksize=65536,tmin=None,tmax=None,blocksize=1<<20):
+    '''
+    Generator over a log in fixed-size chunks of rows, so that arbitrarily
+    large files can be processed in bounded memory.
+    args:
+        fnm -- str path to log file
+        chunksize -- int number of rows per chunk (the last chunk may be shorter)
+        tmin,tmax -- float, optional bounds on the 'time' column; rows outside
+        [tmin,tmax] are dropped
+        blocksize -- int number of bytes read from disk at a time
+    yields:
+        dict of float64 numpy arrays, one per column, each of length <= chunksize
+    '''
+    with open(fnm,'rb') as fromf:
+        header = read_header(fromf)
+        keys = header['keys']
+        ncol = len(keys)
+        tcol = keys.index('time') if 'time' in keys else None
+        pending = []
+        npending = 0
+        remainder = b''
+        while True:
+            raw = fromf.read(blocksize)
+            done = not raw
+            if done:
+                block,remainder = remainder,b''
+            else:
+                # A block without a newline leaves nothing to parse yet: it is
+                # carried over whole, and reading goes on
+                block = remainder+raw
+                cut = block.rfind(b'\n')+1
+                block,remainder = block[:cut],block[cut:]
+            rows = parse_block(block.decode('latin-1'),ncol)
+            if tcol is not None and (tmin is not None or tmax is not None):
+                mask = np.ones(len(rows),dtype=bool)
+                if tmin is not None:
+                    mask &= rows[:,tcol]>=tmin
+                if tmax is not None:
+                    mask &= rows[:,tcol]<=tmax
+                rows = rows[mask]
+            if len(rows):
+                pending.append(rows)
+                npending += len(rows)
+            while npending>=chunksize or (done and npending):
+                table = np.concatenate(pending) if len(pending)>1 else pending[0]
+                yield columns_from_array(table[:chunksize],keys)
+                table = table[chunksize:]
+                pending = [table] if len(table) else []
+                npending = len(table)
+            if done:
+                break
+
+
+def count_rows(fnm,**kwargs):
+    '''
+    Number of data rows in a log (optionally between tmin and tmax), counted
+    chunk by chunk.
+    '''
+    return sum(len(next(iter(chunk.values()))) for chunk in iter_chunks(fnm,**kwargs))
+
+
+def stream_stats(fnm,keys=None,**kwargs):
+    '''
+    Per-column minimum, maximum, mean and row count of a log, accumulated
+    chunk by chunk in bounded memory.
+    args:
+        fnm -- str path to log file
+        keys -- list of column keys to reduce, default all
+        kwargs -- passed on to iter_chunks (chunksize, tmin, tmax)
+    return:
+        dict of column key to dict with 'min', 'max', 'mean' and 'count'
+    '''
+    stats = {}
+    for chunk in iter_chunks(fnm,**kwargs):
+        for k in (keys or chunk.keys()):
+            column = chunk[k]
+            if k not in stats:
+                stats[k] = {'min':np.inf,'max':-np.inf,'sum':0.0,'count':0}
+            stats[k]['min'] = min(stats[k]['min'],float(column.min()))
+            stats[k]['max'] = max(stats[k]['max'],float(column.max()))
+            stats[k]['sum'] += float(column.sum())
+            stats[k]['count'] += len(column)
+    for k in stats:
+        total = stats[k].pop('sum')
+        stats[k]['mean'] = total/stats[k]['count']
+    return stats
+
+
+# Binary sidecar cache: an 8-byte magic, a uint64 length, a JSON header, and
+# then the columns as float64 rows of a (ncol,nrows) array, aligned so that it
+# can be memory-mapped directly.
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'TRCACHE1'
+CACHE_ALIGN = 64
+
+
+def cache_path(fnm):
+    return fnm + CACHE_SUFFIX
+
+
+def file_hash(fnm,blocksize=1<<20):
+    '''
+    Content hash of a file, read in blocks so that memory use is bounded.
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(fnm,'rb') as fromf:
+        for block in iter(lambda: fromf.read(blocksize),b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_key(fnm):
+    stat = os.stat(fnm)
+    return {'path':os.path.abspath(fnm),'size':stat.st_size,'mtime':stat.st_mtime_ns}
+
+
+def write_cache(fnm,header,data):
+    '''
+    Write the parsed columns of fnm to its binary sidecar. The file is written
+    under a temporary name and then renamed, so that readers never see a
+    partial cache.
+    args:
+        fnm -- str path to the source log
+        header -- dict, as returned by read_header
+        data -- dict of float64 numpy arrays, one per column in header['keys']
+    '''
+    meta = _source_key(fnm)
+    meta['hash'] = file_hash(fnm)
+    meta['header'] = header
+    meta['nrows'] = len(data[header['keys'][0]]) if header['keys'] else 0
+    blob = json.dumps(meta).encode('utf-8')
+    start = len(CACHE_MAGIC)+8+len(blob)
+    blob += b' '*(-start%CACHE_ALIGN)
+    table = np.array([data[k] for k in header['keys']],dtype=np.float64)
+    tmpfile = '{:s}.{:d}.tmp'.format(cache_path(fnm),os.getpid())
+    with open(tmpfile,'wb') as tofile:
+        tofile.write(CACHE_MAGIC)
+        tofile.write(struct.pack('<Q',len(blob)))
+        tofile.write(blob)
+        tofile.write(table.astype('<f8').tobytes())
+    os.replace(tmpfile,cache_path(fnm))
+
+
+def read_cache(fnm,verify=False):
+    '''
+    Memory-map the sidecar cache of fnm, if it is present and still matches
+    the source file. The cache is accepted if the path and size match, and
+    either the modification time or the content hash matches. With verify, the
+    content hash is always checked.
+    args:
+        fnm -- str path to the source log
+        verify -- bool, always compare the content hash
+    return:
+        header, data as for parse_file (with read-only memmap columns),
+        or None if there is no valid cache
+    '''
+    try:
+        with open(cache_path(fnm),'rb') as fromf:
+            if fromf.read(len(CACHE_MAGIC))!=CACHE_MAGIC:
+                return None
+            length, = struct.unpack('<Q',fromf.read(8))
+            meta = json.loads(fromf.read(length).decode('utf-8'))
+        source = _source_key(fnm)
+    except (OSError,ValueError,struct.error):
+        return None
+    if meta['path']!=source['path'] or meta['size']!=source['size']:
+        return None
+    if verify or meta['mtime']!=source['mtime']:
+        if meta['hash']!=file_hash(fnm):
+            return None
+    header = meta['header']
+    keys = header['keys']
+    if meta['nrows']==0:
+        return header,{k:np.zeros(0) for k in keys}
+    table = np.memmap(cache_path(fnm),dtype='<f8',mode='r',offset=len(CACHE_MAGIC)+8+length,shape=(len(keys),meta['nrows']))
+    return header,{k:table[i] for i,k in enumerate(keys)}
+
+
+def load_cached(fnm,verify=False):
+    '''
+    Load fnm through its sidecar cache, rebuilding the cache if it is missing
+    or stale. If the cache cannot be written (e.g. a read-only data directory)
+    the freshly parsed columns are returned instead.
+    '''
+    cached = read_cache(fnm,verify)
+    if cached is not None:
+        return cached
+    header,data = parse_file(fnm)
+    try:
+        write_cache(fnm,header,data)
+    except OSError:
+        return header,data
+    return read_cache(fnm) or (header,data)
+
 
 class data_obj:
-    
-    def __init__(self,fnm):
-        
+
+    def __init__(self,fnm,cache=False,follow=False):
+        '''
+        args:
+            fnm -- str path to log file
+            cache -- bool, load through the binary sidecar cache. The columns are
+            then read-only memory-mapped arrays.
+            follow -- bool, follow a log that is still being written. Call
+            refresh() to pick up newly appended lines.
+        '''
+        self.fnm = fnm
+        self.cache = cache
+        self.follow = follow
         self.data = self.load_data(fnm)
-        
-    def __plot_data__(self,x_key,y_key):
-        
+
+    def __plot_data__(self,x_key,y_key,max_points=downsample.MAX_POINTS):
+        '''
+        Plot one column against another. Long traces are reduced to about
+        max_points points by min/max bucketing before drawing; pass
+        max_points=None to draw every point.
+        '''
+        import matplotlib.pyplot as plt
         fig = plt.figure()
         ax = fig.add_subplot(111)
-        ax.plot(self.data[x_key],self.data[y_key])
-        
+        x,y = self.data[x_key],self.data[y_key]
+        if max_points is not None:
+            x,y = downsample.minmax(x,y,max_points)
+        ax.plot(x,y)
+
         return fig,ax
-    
-    
+
+
     def load_data(self,fnm):
-        data = {'time':[],'T':[],'Tr':[],'Vr':[],'Rs':[],'ImV':[],'ReV':[]}
-        with open(fnm,'r') as fromf:
-            for line in fromf:
-                data_line = line.split('|')
-                try:
-                    tmp_data  = [float(t) for t in data_line]
-                except ValueError:
-                    continue
-                data['time'].append(tmp_data[0])
-                data['T'].append(tmp_data[1])
-                data['Tr'].append(tmp_data[2])
-                data['Vr'].append(tmp_data[3])
-                data['ReV'].append(tmp_data[4])
-                data['ImV'].append(tmp_data[5])
-                data['Rs'].append(tmp_data[6])
-        return data    
+        '''
+        Load the log into a dict of numpy arrays, keyed by the short column
+        names in COLUMN_KEYS. The column layout is taken from the file header,
+        so both the older 6-column and newer 7-column logs are supported.
+        '''
+        if self.follow:
+            self.offset = 0
+            self.nrows = 0
+            self._table = None
+            self.refresh()
+            return self.data
+        if self.cache:
+            self.header,data = load_cached(fnm)
+        else:
+            self.header,data = parse_file(fnm)
+        self.columns = self.header['keys']
+        return data
+
+    def refresh(self):
+        '''
+        Follow mode: parse only the complete lines appended since the last call
+        and extend the columns in place. A partly written final line is left
+        for the next call. If the file has shrunk (i.e. it was overwritten), it
+        is re-read from the start.
+        return:
+            int number of new rows
+        '''
+        if os.path.getsize(self.fnm)<self.offset:
+            self.offset = 0
+            self.nrows = 0
+        with open(self.fnm,'rb') as fromf:
+            if self.offset==0:
+                self.header = read_header(fromf)
+                self.columns = self.header['keys']
+                if not self.header['complete']:
+                    # header not (fully) written yet: try again on the next refresh
+                    self._grow(0)
+                    return 0
+                self.offset = self.header['offset']
+            fromf.seek(self.offset)
+            block = fromf.read()
+        cut = block.rfind(b'\n')+1
+        rows = parse_block(block[:cut].decode('latin-1'),len(self.columns))
+        self.offset += cut
+        self._grow(len(rows))
+        self._table[:,self.nrows:self.nrows+len(rows)] = rows.T
+        self.nrows += len(rows)
+        self.data = {k:self._table[i,:self.nrows] for i,k in enumerate(self.columns)}
+        return len(rows)
+
+    def _grow(self,nnew):
+        '''
+        Make room for nnew more rows, doubling the capacity of the column
+        buffer so that appending is amortized constant time per row.
+        '''
+        ncol = len(self.columns)
+        if self._table is None or self._table.shape[0]!=ncol:
+            self._table = np.zeros((ncol,max(1024,nnew)))
+        elif self.nrows+nnew>self._table.shape[1]:
+            table = np.zeros((ncol,max(2*self._table.shape[1],self.nrows+nnew)))
+            table[:,:self.nrows] = self._table[:,:self.nrows]
+            self._table = table
+        self.data = {k:self._table[i,:self.nrows] for i,k in enumerate(self.columns)}
+
 
+###############################################################################
+########################                    ###################################
+########################    BATCH LOADING   ###################################
+########################                    ###################################
+###############################################################################
+
+
+def _prefix_hash(fnm,nbytes,blocksize=1<<20):
+    '''
+    Content hash of the first nbytes of a file.
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(fnm,'rb') as fromf:
+        while nbytes>0:
+            block = fromf.read(min(blocksize,nbytes))
+            if not block:
+                break
+            digest.update(block)
+            nbytes -= len(block)
+    return digest.hexdigest()
+
+
+def _run_key(fnm,nbytes=4096):
+    '''
+    Files from the same run share their header (which carries the start time
+    to the microsecond) and their first block of data.
+    '''
+    return _prefix_hash(fnm,nbytes)
+
+
+def find_duplicates(fnms):
+    '''
+    Group files which are identical to, or a truncated copy of, another file.
+    args:
+        fnms -- list of str paths
+    return:
+        dict mapping each path to the path of the longest file it is a prefix
+        of (itself, for files which are not duplicates)
+    '''
+    sizes = {f:os.path.getsize(f) for f in fnms}
+    groups = {}
+    for f in fnms:
+        groups.setdefault(_run_key(f),[]).append(f)
+    canonical = {}
+    for group in groups.values():
+        group.sort(key=lambda f:(-sizes[f],f))
+        parents = []
+        for f in group:
+            for p in parents:
+                if _prefix_hash(p,sizes[f])==file_hash(f):
+                    canonical[f] = p
+                    break
+            else:
+                parents.append(f)
+                canonical[f] = f
+    return canonical
+
+
+def _load_run(fnm,cache=False):
+    run = data_obj(fnm,cache=cache)
+    return run.header,{k:np.asarray(v) for k,v in run.data.items()}
+
+
+def _complete_rows(fnm,offset):
+    with open(fnm,'rb') as fromf:
+        fromf.seek(offset)
+        return sum(block.count(b'\n') for block in iter(lambda: fromf.read(1<<20),b''))
+
+
+def load_runs(source,processes=None,cache=False):
+    '''
+    Load every log in a directory (or matching a glob pattern) with a pool of
+    worker processes. Files which are identical to or truncated copies of
+    another file are not parsed again; their columns are views onto the rows
+    of the longest copy. On Windows, call this from under
+    if __name__ == "__main__".
+    args:
+        source -- str directory (all *.txt files are loaded) or glob pattern
+        processes -- int number of worker processes, default os.cpu_count()
+        cache -- bool, load through the binary sidecar cache
+    return:
+        list of dict, one per file, sorted by start time, with the 'file',
+        header 'start', 'sample', 'user', 'material', 'columns', 'rows',
+        'size', 'duplicate_of' (None for unique files) and 'data'
+    '''
+    if os.path.isdir(source):
+        source = os.path.join(source,'*.txt')
+    fnms = sorted(glob.glob(source))
+    canonical = find_duplicates(fnms)
+    unique = [f for f in fnms if canonical[f]==f]
+    if processes==1 or len(unique)<2:
+        loaded = [_load_run(f,cache) for f in unique]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            loaded = list(pool.map(_load_run,unique,[cache]*len(unique)))
+    loaded = dict(zip(unique,loaded))
+    catalogue = []
+    for f in fnms:
+        header,data = loaded[canonical[f]]
+        if canonical[f]!=f:
+            nrows = min(_complete_rows(f,header['offset']),len(data[header['keys'][0]]))
+            data = {k:v[:nrows] for k,v in data.items()}
+        catalogue.append({'file':f,
+                          'start':header['start'],
+                          'sample':header['sample'],
+                          'user':header['user'],
+                          'material':header['material'],
+                          'columns':header['keys'],
+                          'rows':len(data[header['keys'][0]]),
+                          'size':os.path.getsize(f),
+                          'duplicate_of':None if canonical[f]==f else canonical[f],
+                          'data':data})
+    catalogue.sort(key=lambda run:(run['start'] or '',run['file']))
+    return catalogue
 
 
 if __name__ == "__main__":
     data_cool = data_obj('C:/Users/rday/Downloads/Transport-master/Transport-master/FeSe_heat_03_11022019.txt')
     data_cool.__plot_data__('T','Rs')
-    
-                
+
+
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:30:59 2026
+
+@author:rday
+
+Writer for the UBC resistivity log format. The file is kept open for the
+whole run and lines are buffered, rather than reopening the file for every
+sample, which is slow on network-mounted lab drives.
+
+"""
+
+import os
+import time
+
+
+RULE = '==========================================================================\n'
+COLUMNS = '  Time(s)  |   Temp(K)   |  Vref(V)  |  ReVs (mV)  |  ImVs (mV)  |  Res(Ohm)  \n'
+LINE = '  {:0.05f}  |  {:0.05f}  |  {:0.05f}  |   {:0.05f}   |   {:0.05f}    |  {:0.05f}  \n'
+
+FSYNC_POLICIES = ('never','flush','line')
+
+
+class log_writer:
+
+    def __init__(self,fnm,append=False,flush_lines=10,flush_interval=10.0,fsync='flush'):
+        '''
+        args:
+            fnm -- str path to log file
+            append -- bool, append to an existing file rather than starting a
+            new one
+            flush_lines -- int number of buffered lines which triggers a flush
+            flush_interval -- float seconds since the last flush which triggers
+            a flush (checked whenever a line is written)
+            fsync -- str crash-safety policy: 'never' leaves the data to the
+            operating system, 'flush' calls os.fsync on every flush, and 'line'
+            flushes and fsyncs every line
+        '''
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('fsync must be one of {:s}'.format(', '.join(FSYNC_POLICIES)))
+        self.fnm = fnm
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffer = []
+        self.last_flush = time.time()
+        self.tofile = open(fnm,'a' if append else 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.tofile is None
+
+    def write_header(self,start,sample,user,material):
+        '''
+        Write the log header, and flush it straight away.
+        args:
+            start -- datetime start of the measurement
+            sample,user,material -- str
+        '''
+        self.buffer.append('UBC Resistivity Measurement:{:s}\n'.format(str(start)))
+        self.buffer.append(RULE)
+        self.buffer.append('Sample Name: {:s}\n'.format(sample))
+        self.buffer.append('User: {:s}\n'.format(user))
+        self.buffer.append('Material: {:s}\n'.format(material))
+        self.buffer.append(RULE)
+        self.buffer.append(COLUMNS)
+        self.buffer.append(RULE)
+        self.flush()
+
+    def write_line(self,seconds,T,Vr,reVs,imVs,Rs):
+        '''
+        Buffer one data line. Voltages are in V, and are written in mV.
+        '''
+        self.buffer.append(LINE.format(seconds,T,Vr,reVs*1000,imVs*1000,Rs))
+        if self.fsync=='line' or len(self.buffer)>=self.flush_lines or self._elapsed()>=self.flush_interval:
+            self.flush()
+
+    def _elapsed(self):
+        return time.time()-self.last_flush
+
+    def flush(self):
+        '''
+        Write out the buffered lines, and fsync according to the policy.
+        '''
+        if self.tofile is None:
+            return
+        if self.buffer:
+            self.tofile.write(''.join(self.buffer))
+            self.buffer = []
+        self.tofile.flush()
+        if self.fsync!='never':
+            os.fsync(self.tofile.fileno())
+        self.last_flush = time.time()
+
+    def close(self):
+        '''
+        Flush and close the file. Safe to call more than once.
+        '''
+        if self.tofile is None:
+            return
+        self.flush()
+        self.tofile.close()
+        self.tofile = None
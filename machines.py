@@ -8,22 +8,355 @@ Created Tue 24 Jan 16:05:00 2019
 @author:rday
 
 """
-import visa
+import os
+import threading
+import time
 
+import numpy as np
 
-rm = visa.ResourceManager()
+import bus
+
+try:
+    import visa
+except ImportError:
+    visa = None
+
+
+class pooled_session:
+
+    def __init__(self,manager,address):
+        '''
+        A VISA session shared by every driver using the same address. Calls
+        are run as transactions by the arbiter of the bus, so the session can
+        be used from several threads, and a call that fails with a bus error
+        is retried on a fresh session, after a backoff delay. Drivers append
+        to self.setup callables taking the resource, which are run on the
+        fresh session before the retry, to restore a configuration that the
+        instrument may have lost (e.g. after a power cycle).
+        '''
+        self.manager = manager
+        self.address = address
+        self.lock = threading.RLock()
+        self.resource = None
+        self.users = 0
+        self.reconnects = 0
+        self.setup = []
+        self.restore = False
+        self.priority = bus.PRIORITY_BULK
+        # Transactions share the session, but an exchange opened by send()
+        # has it to itself until receive() has read the reply
+        self.gate = threading.Condition()
+        self.sharing = 0
+        self.exclusive = False
+        self.waiting = 0
+        self.sent = None
+
+    def _ensure(self):
+        if self.resource is None:
+            self.resource = self.manager.resource_manager().open_resource(self.address)
+        return self.resource
+
+    def _drop(self):
+        if self.resource is not None:
+            try:
+                self.resource.close()
+            except Exception:
+                pass
+            self.resource = None
+
+    def _locked(self,transaction):
+        with self.lock:
+            resource = self._ensure()
+            if self.restore:
+                for setup in self.setup:
+                    setup(resource)
+                self.restore = False
+            return transaction(resource)
+
+    def _enter(self,exclusive):
+        with self.gate:
+            if exclusive:
+                self.waiting += 1
+                self.gate.wait_for(lambda: not self.exclusive and not self.sharing)
+                self.waiting -= 1
+                self.exclusive = True
+            else:
+                self.gate.wait_for(lambda: not self.exclusive and not self.waiting)
+                self.sharing += 1
+
+    def _leave(self,exclusive):
+        with self.gate:
+            if exclusive:
+                self.exclusive = False
+            else:
+                self.sharing -= 1
+            self.gate.notify_all()
+
+    def transaction(self,transaction,label='transaction',coalesce=False):
+        '''
+        Run transaction(resource) on the bus as one unit, so that nothing else
+        reaches the bus in between its calls.
+        args:
+            transaction -- callable taking the VISA resource
+            label -- str command, for the statistics
+            coalesce -- bool, share the result with an identical transaction
+            still waiting in the queue (only for queries without side effects)
+        '''
+        self._enter(False)
+        try:
+            return self._transaction(transaction,label,coalesce)
+        finally:
+            self._leave(False)
+
+    def _transaction(self,transaction,label,coalesce=False):
+        arbiter = self.manager.bus(self.address)
+        key = (self.address,label) if coalesce else None
+        attempt = 0
+        while True:
+            try:
+                return arbiter.run(lambda: self._locked(transaction),label,self.priority,key,self.address)
+            except self.manager.errors as err:
+                if attempt>=self.manager.retries:
+                    raise
+                print('WARNING: {:s} {:s} failed ({:s}), reconnecting'.format(self.address,label,str(err)))
+                with self.lock:
+                    self._drop()
+                    self.restore = True
+                self.manager.stats.retry(self.address)
+                time.sleep(self.manager.backoff(attempt))
+                attempt += 1
+                self.reconnects += 1
+
+    def _call(self,method,*args,coalesce=False,**kwargs):
+        label = args[0] if args and isinstance(args[0],str) else method
+        return self.transaction(lambda resource: getattr(resource,method)(*args,**kwargs),label,coalesce)
+
+    def query(self,*args,coalesce=False,**kwargs):
+        '''
+        Query, holding the bus until the reply has been read. Pass
+        coalesce=True only for queries without side effects (e.g. KRDG?, not
+        the HP3478A trigger T3), to share the reply with identical queries
+        waiting on the bus.
+        '''
+        return self._call('query',*args,coalesce=coalesce,**kwargs)
+
+    def write(self,*args,**kwargs):
+        return self._call('write',*args,**kwargs)
+
+    def read(self,*args,**kwargs):
+        return self._call('read',*args,**kwargs)
+
+    def query_raw(self,command):
+        '''
+        Write command and read back the raw bytes of the reply, as one
+        transaction, e.g. for a binary block transfer.
+        '''
+        def transaction(resource):
+            resource.write(command)
+            return resource.read_raw()
+        return self.transaction(transaction,command)
+
+    def send(self,command):
+        '''
+        First half of a split query: write command, and keep the session to
+        this caller until receive() has read the reply. The bus itself is free
+        in between, so other instruments can be triggered or read while this
+        one measures.
+        '''
+        self._enter(True)
+        try:
+            self._transaction(lambda resource: resource.write(command),command)
+        except BaseException:
+            self._leave(True)
+            raise
+        self.sent = command
+
+    def receive(self):
+        '''
+        Second half of a split query: read the reply to the command given to
+        send(). After a reconnect the command is sent again before reading.
+        '''
+        command,attempts = self.sent,[]
+
+        def transaction(resource):
+            if attempts:
+                resource.write(command)
+            attempts.append(resource)
+            return resource.read()
+
+        try:
+            return self._transaction(transaction,'{:s} <read>'.format(command))
+        finally:
+            self.sent = None
+            self._leave(True)
+
+    def __getattr__(self,name):
+        # Anything else (e.g. timeout, read_raw) goes straight to the session.
+        with self.lock:
+            return getattr(self._ensure(),name)
+
+    def before_close(self):
+        pass
+
+    def close(self):
+        '''
+        Release this user of the session; the session itself is closed once
+        its last user has released it.
+        '''
+        self.manager.release(self)
+
+
+class session_manager:
+
+    def __init__(self,factory=None,retries=5,backoff_base=0.5,backoff_max=30.0):
+        '''
+        Pool of VISA sessions, keyed by address. The resource manager is only
+        created when the first session is opened.
+        args:
+            factory -- callable returning a resource manager, default
+            visa.ResourceManager
+            retries -- int number of reconnect attempts for a failed call
+            backoff_base,backoff_max -- float seconds: the delay before
+            reconnect attempt k is backoff_base*2**k, up to backoff_max
+        '''
+        self.factory = factory
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rm = None
+        self.pool = {}
+        self.buses = {}
+        self.stats = bus.bus_stats()
+        self.lock = threading.Lock()
+        self.errors = (OSError,)
+        if visa is not None and hasattr(visa,'VisaIOError'):
+            self.errors = (OSError,visa.VisaIOError)
+
+    def backoff(self,attempt):
+        return min(self.backoff_base*2**attempt,self.backoff_max)
+
+    def set_backend(self,factory):
+        '''
+        Close every session and use factory for the resource manager from now on.
+        '''
+        self.close_all()
+        with self.lock:
+            self.factory = factory
+            self.rm = None
+
+    def resource_manager(self):
+        with self.lock:
+            if self.rm is None:
+                if self.factory is not None:
+                    self.rm = self.factory()
+                elif visa is not None:
+                    self.rm = visa.ResourceManager()
+                else:
+                    raise ImportError('pyvisa is not installed: call machines.use_simulator() to run without hardware')
+            return self.rm
+
+    def bus(self,address):
+        '''
+        The bus_arbiter of the bus of address, shared by every session on it.
+        '''
+        name = bus.bus_name(address)
+        with self.lock:
+            arbiter = self.buses.get(name)
+            if arbiter is None:
+                arbiter = self.buses[name] = bus.bus_arbiter(name,self.stats)
+            return arbiter
+
+    def report(self):
+        '''
+        Live bus statistics: the bus_stats summary, with 'buses', a dict of bus
+        name to its busy fraction and transaction counts.
+        '''
+        with self.lock:
+            buses = {name:arbiter.report() for name,arbiter in self.buses.items()}
+        return dict(self.stats.summary(),buses=buses)
+
+    def dump_stats(self,fnm):
+        '''
+        Write the bus statistics and latency histograms to fnm as JSON.
+        '''
+        with self.lock:
+            buses = {name:arbiter.report() for name,arbiter in self.buses.items()}
+        self.stats.dump(fnm,buses=buses)
+
+    def reset_stats(self):
+        self.stats.reset()
+        with self.lock:
+            for arbiter in self.buses.values():
+                arbiter.reset()
+
+    def open(self,address):
+        '''
+        Shared session for address, reusing one that is already open.
+        '''
+        with self.lock:
+            session = self.pool.get(address)
+            if session is None:
+                session = pooled_session(self,address)
+                self.pool[address] = session
+            session.users += 1
+        return session
+
+    def release(self,session):
+        with self.lock:
+            session.users -= 1
+            if session.users>0:
+                return
+            if self.pool.get(session.address) is session:
+                del self.pool[session.address]
+        with session.lock:
+            session._drop()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.pool.values())
+            self.pool = {}
+        for session in sessions:
+            with session.lock:
+                session._drop()
+
+
+sessions = session_manager()
+
+
+def use_simulator(**kwargs):
+    '''
+    Swap the VISA resource manager for the simulated backend in sim_machines,
+    so that the drivers below can be used without GPIB hardware. Instruments
+    created afterwards talk to the simulator.
+    args:
+        kwargs -- passed to sim_machines.sim_resource_manager (e.g. latency,
+        noise, Tc, or replay='FeSe_cooldown_03_11022019.txt')
+    '''
+    import sim_machines
+    sessions.set_backend(lambda: sim_machines.sim_resource_manager(**kwargs))
+    return sessions
+
+
+def _open(address):
+    return sessions.open(address)
+
+
+if os.environ.get('TRANSPORT_SIMULATE'):
+    use_simulator()
 
 class HP3478A:
     
     def __init__(self,HPIB_address):
         
         self.address = 'GPIB0::{:d}::INSTR'.format(HPIB_address)
+        self.config = None
         self.instrument = self._connect()
+        self.instrument.setup.append(self._restore)
         
         
     def _connect(self):
         
-        return rm.open_resource(self.address)
+        return _open(self.address)
     
     
     def _read_screen(self):
@@ -34,7 +367,6 @@ class HP3478A:
         
     def _disconnect(self):
         
-        self.instrument.before_close()
         self.instrument.close()
         
     def _do_acv_measure(self):
@@ -43,13 +375,90 @@ class HP3478A:
         Autorange (RA)
         Autozero on (Z1)
         4.5 digits (N4) -- F2RAZ1N4: returns an ac voltage measurement
+        The configuration is only sent the first time; after that each
+        reading is a single trigger.
         '''
-        return float(self.instrument.query("F2RAZ1N4"))
+        self._configure(function=2,fixed_range=None,autozero=True,digits=4)
+        return self._trigger()
+    
+    
+    def _configure(self,function=2,fixed_range=None,autozero=True,digits=4):
+        '''
+        Set up the meter once, with triggering on hold (T4), so that readings
+        can then be taken with _trigger or _burst. Nothing is sent if the meter
+        is already in this configuration.
+        args:
+            function -- int HP3478A function code: 1 DCV, 2 ACV, 3 2-wire Ohm,
+            4 4-wire Ohm, 5 DCI, 6 ACI, 7 extended Ohm
+            fixed_range -- int range code (R-2..R7, e.g. -1 is 300 mV for ACV),
+            or None to autorange. A fixed range is faster.
+            autozero -- bool. Autozero off roughly halves the reading time.
+            digits -- int 3, 4 or 5, for 3.5, 4.5 or 5.5 digits
+        '''
+        config = 'F{:d}R{:s}Z{:d}N{:d}'.format(function,'A' if fixed_range is None else '{:d}'.format(fixed_range),
+                                              int(autozero),digits)
+        if config!=self.config:
+            self.instrument.write(config+'T4')
+            self.config = config
+    
+    
+    def _restore(self,resource):
+        '''
+        Send the configuration again on a fresh session, as the meter may
+        have lost it (e.g. after a power cycle).
+        '''
+        if self.config is not None:
+            resource.write(self.config+'T4')
+    
+    
+    def _trigger(self):
+        '''
+        Single trigger (T3) and read, in the current configuration.
+        '''
+        return float(self.instrument.query('T3'))
+    
+    
+    def _start_acv(self):
+        '''
+        Trigger an ac voltage reading (as _do_acv_measure) without waiting for
+        it: the bus is free while the meter integrates, until _fetch_reading.
+        '''
+        self._configure(function=2,fixed_range=None,autozero=True,digits=4)
+        self.instrument.send('T3')
+        
+        
+    def _fetch_reading(self):
+        
+        return float(self.instrument.receive())
+    
+    
+    def _burst(self,samples,fast=True):
+        '''
+        Take samples readings back to back, holding the bus for the whole burst.
+        args:
+            samples -- int number of readings
+            fast -- bool, use the fast trigger (T5), which skips the settling
+            delay of the single trigger
+        return:
+            numpy array of float
+        '''
+        if self.config is None:
+            self._configure()
+        command = 'T5' if fast else 'T3'
+        
+        def burst(resource):
+            return np.array([float(resource.query(command)) for i in range(samples)])
+        
+        return self.instrument.transaction(burst,'{:s} burst'.format(command))
     
     
     
     
     
+LS331_STATE = 'KRDG? A;KRDG? B;SRDG? A;SRDG? B;HTR?;SETP? {:d}'
+LS331_FIELDS = ('T_A','T_B','Tr_A','Tr_B','heater','setpoint')
+
+
 class LS331:
     
     def __init__(self,GPIB_address,channel):
@@ -57,21 +466,63 @@ class LS331:
         self.address = 'GPIB0::{:d}::INSTR'.format(GPIB_address)
         self.channel = channel
         self.instrument = self._connect()
+        # Temperature control reads go ahead of the resistance reads on the bus
+        self.instrument.priority = bus.PRIORITY_CONTROL
         
     def _connect(self):
         
-        return rm.open_resource(self.address)
+        return _open(self.address)
         
         
     def _disconnect(self):
         
-        self.instrument.before_close()
         self.instrument.close()
         
         
     def _measure_T(self):
-        Tnow = self.instrument.query('KRDG? {:s}'.format(self.channel))
+        Tnow = self.instrument.query('KRDG? {:s}'.format(self.channel),coalesce=True)
         return float(Tnow)
+    
+    
+    def _request_T(self):
+        '''
+        Split form of _measure_T: send the query, and read the reply later
+        with _fetch_T.
+        '''
+        self.instrument.send('KRDG? {:s}'.format(self.channel))
+        
+        
+    def _fetch_T(self):
+        
+        return float(self.instrument.receive())
+    
+    
+    def _read_state(self,loop=1):
+        '''
+        Temperatures (K) and sensor units (Ohm) of channels A and B, with the
+        heater output and setpoint, from one combined query (the LS331 answers
+        queries joined by ';' in a single reply).
+        args:
+            loop -- int control loop of the setpoint
+        return:
+            dict of 'T' and 'Tr' (the reading channel, as in the log columns),
+            'T_A','T_B','Tr_A','Tr_B','heater' (% of range) and 'setpoint' (K)
+        '''
+        reply = self.instrument.query(LS331_STATE.format(loop),coalesce=True)
+        values = [float(v) for v in reply.strip().split(';')]
+        state = dict(zip(LS331_FIELDS,values))
+        state['T'] = state['T_{:s}'.format(self.channel)]
+        state['Tr'] = state['Tr_{:s}'.format(self.channel)]
+        return state
+    
+    
+    def _set_setpoint(self,T,loop=1):
+        
+        self.instrument.write('SETP {:d},{:0.3f}'.format(loop,T))
+
+
+SNAP_PARAMS = {'X':1,'Y':2,'R':3,'theta':4,'freq':9}
+SRAT_BASE = 0.0625
 
 
 class SR850:
@@ -79,33 +530,133 @@ class SR850:
     def __init__(self,GPIB_address,freq=27.2,Vin=1.0):
         
         self.address = 'GPIB::{:d}::INSTR'.format(GPIB_address)
+        self.buffer_rate = None
+        self.buffer_start = None
         self.instrument = self._connect()
         self._instrument_setup(freq,Vin)
         
     def _connect(self):
         
-        return rm.open_resource(self.address)
+        return _open(self.address)
     
     def _instrument_setup(self,freq,Vin):
-        self.instrument.write('FMOD 0',termination='<lf>')
-        self.instrument.write('FREQ {:0.03f}'.format(freq),termination='<lf>')
-        self.instrument.write('SLVL {:0.03f}'.format(Vin),termination='<lf>')
-        self.instrument.write('STRT',termination='<lf>')
+        self.instrument.write('FMOD 0')
+        self.instrument.write('FREQ {:0.03f}'.format(freq))
+        self.instrument.write('SLVL {:0.03f}'.format(Vin))
+        self.instrument.write('STRT')
         
         
         
         
     def _disconnect(self):
         
-        self.instrument.before_close()
         self.instrument.close()
     
     
     def _measure_V(self):
+        '''
+        X and Y, read in one SNAP? query so that both come from the same
+        instant (OUTP? 1 then OUTP? 2 reads them a bus round trip apart).
+        '''
+        snap = self._snapshot('X','Y')
+        return snap['X'],snap['Y']
+    
+    
+    def _request_V(self):
+        '''
+        Split form of _measure_V: send the SNAP? query, and read the reply
+        later with _fetch_V.
+        '''
+        self.instrument.send('SNAP? 1,2')
+        
         
-        x = float(self.instrument.query('OUTP? 1'))
-        y = float(self.instrument.query('OUTP? 2'))
-        return x,y
+    def _fetch_V(self):
+        
+        x,y = self.instrument.receive().split(',')
+        return float(x),float(y)
+    
+    
+    def _snapshot(self,*params):
+        '''
+        Read several parameters at the same instant with a single SNAP? query.
+        args:
+            params -- str keys of SNAP_PARAMS (2 to 6 of them), default X, Y,
+            R, theta and freq
+        return:
+            dict of param to float
+        '''
+        params = params or ('X','Y','R','theta','freq')
+        codes = ','.join('{:d}'.format(SNAP_PARAMS[p]) for p in params)
+        values = self.instrument.query('SNAP? {:s}'.format(codes),coalesce=True).split(',')
+        return {p:float(v) for p,v in zip(params,values)}
+    
+    
+    def _start_buffer(self,rate=64.0,loop=False):
+        '''
+        Start storing X and Y in the lock-in's internal buffer (traces 1 and 2),
+        for reading back in bulk with _read_buffer.
+        args:
+            rate -- float sample rate (Hz), rounded to the nearest SRAT rate,
+            62.5 mHz*2**i for i = 0..13
+            loop -- bool, keep storing once the buffer is full, overwriting the
+            oldest points, rather than stopping
+        return:
+            float the sample rate used (Hz)
+        '''
+        index = int(np.clip(np.round(np.log2(rate/SRAT_BASE)),0,13))
+        # Trace i stores quantity j*k/l, where 0 = 1, 1 = X and 2 = Y
+        self.instrument.write('TRCD 1,1,0,0,1')
+        self.instrument.write('TRCD 2,2,0,0,1')
+        self.instrument.write('SRAT {:d}'.format(index))
+        self.instrument.write('SEND {:d}'.format(int(loop)))
+        self.instrument.write('REST')
+        self.instrument.write('STRT')
+        self.buffer_rate = SRAT_BASE*2**index
+        self.buffer_start = time.time()
+        return self.buffer_rate
+    
+    
+    def _stop_buffer(self):
+        
+        self.instrument.write('PAUS')
+        
+        
+    def _buffer_points(self):
+        
+        return int(self.instrument.query('SPTS?',coalesce=True))
+    
+    
+    def _read_trace(self,trace,start,count):
+        '''
+        Binary transfer (TRCB?) of count points of a trace, from point start.
+        return:
+            numpy array of float32
+        '''
+        raw = self.instrument.query_raw('TRCB? {:d},{:d},{:d}'.format(trace,start,count))
+        return np.frombuffer(raw[:4*count],dtype='<f4')
+    
+    
+    def _read_buffer(self,start=0,count=None):
+        '''
+        Pull the points stored since _start_buffer, in one binary transfer per
+        trace.
+        args:
+            start -- int index of first point
+            count -- int number of points, default all of those stored
+        return:
+            dict of 'time' (float epoch seconds, from the start time and sample
+            rate), 'X' and 'Y' (V) numpy arrays
+        '''
+        if count is None:
+            count = self._buffer_points()-start
+        if count<=0:
+            empty = np.zeros(0)
+            return {'time':empty,'X':empty,'Y':empty}
+        X = self._read_trace(1,start,count).astype(float)
+        Y = self._read_trace(2,start,len(X)).astype(float)
+        n = min(len(X),len(Y))
+        stamps = self.buffer_start+(start+np.arange(n))/self.buffer_rate
+        return {'time':stamps,'X':X[:n],'Y':Y[:n]}
     
     
-    
\ No newline at end of file
+    
\ No newline at end of file
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:43:27 2026
+
+@author:rday
+
+Temperature programs for the transport cryostat: a sequence of ramps, dwells
+and measurement points, run by interface.cycle_update. A sweep places its
+measurement points adaptively, stepping the setpoint so that each step
+changes the resistance by about the same amount: the points are dense where
+dR/dT is large, e.g. through a superconducting transition, and sparse where
+the resistance is flat, which saves most of the cryostat time of a uniform
+grid fine enough to resolve Tc.
+
+A step is a dict with
+    'setpoint' -- float temperature (K)
+    'rate' -- float ramp rate (K/min), or None to keep the current rate
+    'measure' -- bool, acquire a resistance point once stable
+    'dwell' -- float seconds to hold once the setpoint is reached
+    'segment' -- str description of the segment the step belongs to
+
+"""
+
+import json
+
+import numpy as np
+
+
+class ramp:
+
+    def __init__(self,target,rate=None):
+        '''
+        Move the setpoint to target, without measuring.
+        args:
+            target -- float temperature (K)
+            rate -- float K/min, default the current rate
+        '''
+        self.target = target
+        self.rate = rate
+
+    def __repr__(self):
+        return 'ramp to {:0.3f} K'.format(self.target)
+
+    def run(self,setpoint):
+        yield {'setpoint':self.target,'rate':self.rate,'measure':False,'dwell':0.0,'segment':repr(self)}
+
+
+class dwell:
+
+    def __init__(self,seconds):
+        '''
+        Hold the current setpoint for seconds, without measuring.
+        '''
+        self.seconds = seconds
+
+    def __repr__(self):
+        return 'dwell {:0.1f} s'.format(self.seconds)
+
+    def run(self,setpoint):
+        yield {'setpoint':setpoint,'rate':None,'measure':False,'dwell':self.seconds,'segment':repr(self)}
+
+
+class point:
+
+    def __init__(self,temperatures,rate=None):
+        '''
+        Measure at each of a fixed list of temperatures.
+        args:
+            temperatures -- float or list of float (K)
+            rate -- float K/min, default the current rate
+        '''
+        self.temperatures = list(np.atleast_1d(temperatures))
+        self.rate = rate
+
+    def __repr__(self):
+        return 'points at {:s} K'.format(', '.join('{:0.3f}'.format(T) for T in self.temperatures))
+
+    def run(self,setpoint):
+        for T in self.temperatures:
+            yield {'setpoint':float(T),'rate':self.rate,'measure':True,'dwell':0.0,'segment':repr(self)}
+
+
+class sweep:
+
+    def __init__(self,start,stop,dT_min=0.05,dT_max=5.0,dR=None,resolution=0.02,growth=2.0,rate=None):
+        '''
+        Measurement points from start to stop, with a step chosen from the
+        measured dR/dT of the last two points: step = dR/|dR/dT|, within
+        dT_min and dT_max. The step may grow by at most a factor growth
+        from one point to the next, so that a sharp feature is not jumped
+        over from a flat region, but shrinks at once when the slope rises.
+        args:
+            start,stop -- float temperatures (K)
+            dT_min,dT_max -- float smallest and largest step (K)
+            dR -- float resistance change per step (Ohm), default resolution
+            times the largest resistance measured so far
+            resolution -- float, see dR
+            growth -- float largest ratio of successive steps
+            rate -- float K/min, default the current rate
+        '''
+        self.start,self.stop = start,stop
+        self.dT_min,self.dT_max = dT_min,dT_max
+        self.dR = dR
+        self.resolution = resolution
+        self.growth = growth
+        self.rate = rate
+
+    def __repr__(self):
+        return 'sweep {:0.3f} to {:0.3f} K'.format(self.start,self.stop)
+
+    def next_step(self,measured,previous):
+        '''
+        Step (K) after the points measured so far.
+        args:
+            measured -- list of (T,R) tuples
+            previous -- float last step (K)
+        '''
+        if len(measured)<2:
+            return self.dT_min
+        (T0,R0),(T1,R1) = measured[-2:]
+        slope = abs(R1-R0)/max(abs(T1-T0),1e-9)
+        dR = self.dR if self.dR is not None else self.resolution*max(abs(R) for T,R in measured)
+        wanted = dR/slope if slope>0 else self.dT_max
+        return float(np.clip(wanted,self.dT_min,min(self.dT_max,self.growth*previous)))
+
+    def run(self,setpoint):
+        direction = 1.0 if self.stop>=self.start else -1.0
+        measured = []
+        T,step = self.start,self.dT_min
+        while True:
+            result = yield {'setpoint':T,'rate':self.rate,'measure':True,'dwell':0.0,'segment':repr(self)}
+            if result is not None:
+                measured.append(result)
+            if T==self.stop:
+                return
+            step = self.next_step(measured,step)
+            T = self.stop if direction*(self.stop-T)<=step else T+direction*step
+
+
+SEGMENTS = {'ramp':ramp,'dwell':dwell,'point':point,'sweep':sweep}
+
+
+class temperature_program:
+
+    def __init__(self,segments):
+        '''
+        args:
+            segments -- list of ramp, dwell, point and sweep segments, run in
+            order
+        '''
+        self.segments = list(segments)
+        self.index = 0
+        self.runner = None
+        self.current = None
+        self.setpoint = None
+        self.results = []
+
+    @property
+    def finished(self):
+        return self.index>=len(self.segments)
+
+    def start(self,setpoint=None):
+        '''
+        Start from the first segment.
+        args:
+            setpoint -- float current setpoint (K), held by a leading dwell
+        return:
+            dict first step, or None for an empty program
+        '''
+        self.index = 0
+        self.runner = None
+        self.results = []
+        self.setpoint = setpoint
+        return self._next(None)
+
+    def advance(self,result=None):
+        '''
+        Finish the current step, and move on to the next.
+        args:
+            result -- (T,R) tuple of the point measured in the current step,
+            if it measured one
+        return:
+            dict next step, or None once the program is finished
+        '''
+        if result is not None:
+            self.results.append(result)
+        return self._next(result)
+
+    def _next(self,result):
+        while not self.finished:
+            try:
+                if self.runner is None:
+                    self.runner = self.segments[self.index].run(self.setpoint)
+                    step = next(self.runner)
+                else:
+                    step = self.runner.send(result)
+            except StopIteration:
+                self.index += 1
+                self.runner = None
+                result = None
+                continue
+            self.current = step
+            self.setpoint = step['setpoint']
+            return step
+        self.current = None
+        return None
+
+
+def load_program(fnm):
+    '''
+    Read a program from a JSON list of segments, each a dict of its type and
+    arguments, e.g.
+        [{"type":"ramp","target":20.0,"rate":2.0},
+         {"type":"sweep","start":20.0,"stop":4.0,"dT_min":0.02,"dT_max":2.0},
+         {"type":"dwell","seconds":600}]
+    '''
+    with open(fnm,'r') as fromf:
+        items = json.load(fromf)
+    segments = []
+    for item in items:
+        item = dict(item)
+        segments.append(SEGMENTS[item.pop('type')](**item))
+    return temperature_program(segments)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:29:37 2026
+
+@author:rday
+
+Resistance against temperature on a fixed grid. A run is split into its
+monotonic heating and cooling branches, each branch is binned onto the grid,
+and the heating-minus-cooling difference gives the thermal hysteresis. All of
+the per-point work is done with numpy, so million-row runs take milliseconds.
+
+"""
+
+import numpy as np
+
+
+def _smooth(values,window):
+    '''
+    Centred moving average over window points, using a cumulative sum.
+    '''
+    if window<=1 or len(values)<window:
+        return np.asarray(values,dtype=np.float64)
+    csum = np.cumsum(np.concatenate(([0.0],values)))
+    core = (csum[window:]-csum[:-window])/window
+    lead = (window-1)//2
+    return np.concatenate((np.full(lead,core[0]),core,np.full(len(values)-len(core)-lead,core[-1])))
+
+
+def split_branches(T,min_span=0.5,window=5):
+    '''
+    Split a temperature trace into monotonic branches. The trace is smoothed
+    over window points and reduced to the points where it crosses a level of
+    a grid with spacing min_span/2. A turning point is only accepted once the
+    trace has moved back by a full min_span from its last extreme, so
+    thermometer noise at the top or bottom of a sweep does not create spurious
+    branches. Only the level crossings are visited in Python, so the cost is
+    set by the temperature range covered rather than the number of rows.
+    args:
+        T -- array of temperatures, in acquisition order
+        min_span -- float smallest temperature reversal (K) that starts a branch
+        window -- int number of points in the smoothing window
+    return:
+        list of (start,stop,direction) -- slice bounds into T, and +1 for
+        heating or -1 for cooling
+    '''
+    T = _smooth(np.asarray(T,dtype=np.float64),window)
+    if len(T)<2:
+        return []
+    level = np.floor(T/(0.5*min_span)).astype(np.int64)
+    crossings = np.flatnonzero(np.diff(level))+1
+    turns = []
+    direction = 0
+    extreme,extreme_at = level[0],0
+    for i in crossings:
+        L = level[i]
+        if direction==0:
+            if abs(L-level[0])>=2:
+                direction = 1 if L>level[0] else -1
+                extreme,extreme_at = L,i
+        elif direction*(L-extreme)>0:
+            extreme,extreme_at = L,i
+        elif direction*(extreme-L)>=2:
+            turns.append((extreme_at,i,direction))
+            direction = -direction
+            extreme,extreme_at = L,i
+    if direction==0:
+        return []
+    # Place each turning point at the actual extreme between the level
+    # crossing where it was reached and the one that confirmed the reversal.
+    cuts = [lo+int(np.argmax(d*T[lo:hi])) for lo,hi,d in turns]
+    starts = [0]+cuts
+    stops = cuts+[len(T)]
+    signs = [d for _,_,d in turns]+[direction]
+    return [(int(a),int(b),d) for a,b,d in zip(starts,stops,signs)]
+
+
+def bin_branch(T,R,edges):
+    '''
+    Bin R(T) onto a temperature grid.
+    args:
+        T,R -- arrays of temperature and resistance
+        edges -- array of bin edges (K), increasing
+    return:
+        dict of arrays, one entry per bin: 'T' (bin centre), 'mean' and 'sem'
+        (standard error) of R, and 'count'. Empty bins hold nan; bins with a
+        single point have a sem of nan.
+    '''
+    T = np.asarray(T,dtype=np.float64)
+    R = np.asarray(R,dtype=np.float64)
+    edges = np.asarray(edges,dtype=np.float64)
+    nbins = len(edges)-1
+    index = np.searchsorted(edges,T,side='right')-1
+    inside = (index>=0)&(index<nbins)
+    # Include points that sit exactly on the top edge in the last bin.
+    inside |= T==edges[-1]
+    index = np.clip(index[inside],0,nbins-1)
+    values = R[inside]
+    count = np.bincount(index,minlength=nbins)
+    total = np.bincount(index,weights=values,minlength=nbins)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mean = total/count
+        resid = values-mean[index]
+        var = np.bincount(index,weights=resid*resid,minlength=nbins)/(count-1)
+        sem = np.sqrt(var/count)
+    sem[count<2] = np.nan
+    return {'T':0.5*(edges[1:]+edges[:-1]),'mean':mean,'sem':sem,'count':count}
+
+
+def bin_run(data,edges,T_key='T',R_key='Rs',min_span=0.5,window=5):
+    '''
+    Bin the heating and cooling branches of a run onto a temperature grid and
+    take their difference.
+    args:
+        data -- dict of column arrays, e.g. load_data.data_obj(fnm).data
+        edges -- array of bin edges (K), increasing
+        T_key,R_key -- keys of the temperature and resistance columns
+        min_span,window -- passed to split_branches
+    return:
+        dict with 'heating' and 'cooling' (as returned by bin_branch, pooling
+        all branches of each direction), 'hysteresis' (heating minus cooling,
+        with 'T', 'mean' and 'sem') and the 'branches' found
+    '''
+    T = np.asarray(data[T_key],dtype=np.float64)
+    R = np.asarray(data[R_key],dtype=np.float64)
+    branches = split_branches(T,min_span,window)
+    direction = np.zeros(len(T),dtype=int)
+    for start,stop,sign in branches:
+        direction[start:stop] = sign
+    heating = bin_branch(T[direction>0],R[direction>0],edges)
+    cooling = bin_branch(T[direction<0],R[direction<0],edges)
+    hysteresis = {'T':heating['T'],
+                  'mean':heating['mean']-cooling['mean'],
+                  'sem':np.hypot(heating['sem'],cooling['sem'])}
+    return {'heating':heating,'cooling':cooling,'hysteresis':hysteresis,'branches':branches}
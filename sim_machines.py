@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:34:56 2026
+
+@author:rday
+
+Simulated GPIB backend for machines.py, so that the acquisition code can be
+tested and benchmarked away from the cryostat. sim_resource_manager stands in
+for visa.ResourceManager: the resources it opens answer the command strings
+used by the HP3478A, LS331 and SR850 drivers, with a configurable latency and
+noise. The readings come either from a model cooldown through a
+superconducting transition, or from replaying an existing log.
+
+Use it with machines.use_simulator(), or by setting TRANSPORT_SIMULATE=1
+before machines is imported.
+
+"""
+
+import re
+import time
+import threading
+
+import numpy as np
+
+
+BUFFER_POINTS = 32768
+
+HP_CODE = re.compile(r'([FRZNT])(-?\d|A)')
+HP_COMMAND = re.compile(r'(?:[FRZNT](?:-?\d|A))+')
+
+
+class model_world:
+
+    def __init__(self,T_start=300.0,T_end=4.2,tau=3600.0,speed=1.0,Tc=9.0,width=0.3,R0=0.005,slope=0.0022,
+                 Rr=1.0e4,amplification=1.0e2,Vref=0.95,noise=1.0e-3,seed=None):
+        '''
+        A model cryostat: the temperature relaxes exponentially from T_start
+        towards T_end, and the sample resistance is linear in T in the normal
+        state and falls to zero through a transition at Tc.
+        args:
+            T_start,T_end -- float temperatures (K)
+            tau -- float cooling time constant (s)
+            speed -- float simulated seconds per real second
+            Tc,width -- float transition temperature and width (K)
+            R0,slope -- float normal-state resistance R0+slope*T (Ohm)
+            Rr,amplification,Vref -- float reference resistor (Ohm), sample
+            voltage gain and reference voltage (V), as in ubc_resistivity
+            noise -- float relative noise of each reading
+            seed -- int, optional random seed
+        '''
+        self.T_start,self.T_end,self.tau,self.speed = T_start,T_end,tau,speed
+        self.Tc,self.width,self.R0,self.slope = Tc,width,R0,slope
+        self.Rr,self.amplification,self.Vref = Rr,amplification,Vref
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+        self.lock = threading.Lock()
+        self.t0 = time.time()
+        self.t_target = 0.0
+
+    def elapsed(self):
+        return (time.time()-self.t0)*self.speed
+
+    def _ideal_temperature(self):
+        return self.T_end+(self.T_start-self.T_end)*np.exp(-(self.elapsed()-self.t_target)/self.tau)
+
+    def set_target(self,T):
+        '''
+        New temperature setpoint (K): from now on the temperature relaxes
+        towards T, with the same time constant.
+        '''
+        with self.lock:
+            self.T_start = self._ideal_temperature()
+            self.T_end = T
+            self.t_target = self.elapsed()
+
+    def heater(self):
+        '''
+        Heater output (% of range) of a proportional loop holding the setpoint.
+        '''
+        return float(np.clip(0.2*self.T_end+10.0*(self.T_end-self._ideal_temperature()),0.0,100.0))
+
+    def gauss(self):
+        with self.lock:
+            return self.random.normal()
+
+    def _noisy(self,value):
+        return value*(1.0+self.noise*self.gauss()) if self.noise else value
+
+    def temperature(self):
+        return self._noisy(self._ideal_temperature())
+
+    def sensor(self,T):
+        '''
+        Sensor units (Ohm) of a Cernox-like thermometer.
+        '''
+        return 3000.0/(1.0+T)
+
+    def resistance(self,T):
+        return (self.R0+self.slope*T)/(1.0+np.exp(-(T-self.Tc)/self.width))
+
+    def reference(self):
+        return self._noisy(self.Vref)
+
+    def lockin(self,Vr=None):
+        '''
+        In-phase and quadrature lock-in voltages (V).
+        '''
+        Vr = self.Vref if Vr is None else Vr
+        X = self.resistance(self.temperature())*Vr/self.Rr*self.amplification
+        return self._noisy(X),self._noisy(0.01*X)
+
+
+class replay_world(model_world):
+
+    def __init__(self,fnm,speed=1.0,loop=True,**kwargs):
+        '''
+        Replay the readings of an existing log (e.g. FeSe_cooldown_03_11022019.txt)
+        in simulated time.
+        args:
+            fnm -- str path to log
+            speed -- float simulated seconds per real second
+            loop -- bool, start again at the end of the log, rather than
+            holding the last row
+            kwargs -- passed to model_world (noise defaults to 0)
+        '''
+        import load_data
+        kwargs.setdefault('noise',0.0)
+        model_world.__init__(self,speed=speed,**kwargs)
+        header,data = load_data.parse_file(fnm)
+        self.data = data
+        self.times = data['time']-data['time'][0]
+        self.loop = loop
+
+    def _row(self):
+        t = self.elapsed()
+        if self.loop and self.times[-1]>0:
+            t = t%self.times[-1]
+        return min(int(np.searchsorted(self.times,t,side='right'))-1,len(self.times)-1)
+
+    def temperature(self):
+        return self._noisy(self.data['T'][self._row()])
+
+    def sensor(self,T):
+        if 'Tr' in self.data:
+            return self.data['Tr'][self._row()]
+        return model_world.sensor(self,T)
+
+    def reference(self):
+        return self._noisy(self.data['Vr'][self._row()])
+
+    def lockin(self,Vr=None):
+        row = self._row()
+        return self._noisy(self.data['ReV'][row]*1.0e-3),self._noisy(self.data['ImV'][row]*1.0e-3)
+
+
+class sim_instrument:
+
+    def __init__(self,address,world,latency=0.05,jitter=0.01,fail_rate=0.0):
+        '''
+        One simulated GPIB resource, answering HP3478A, LS331 and SR850
+        commands from the shared world.
+        args:
+            address -- str VISA address
+            world -- model_world or replay_world
+            latency -- float mean seconds the instrument takes to answer a
+            command: it works on the command after the write, and a read waits
+            until it is done
+            jitter -- float standard deviation of the latency (s)
+            fail_rate -- float probability that a call raises a simulated bus
+            timeout (OSError), for exercising reconnects
+        '''
+        self.address = address
+        self.fail_rate = fail_rate
+        self.world = world
+        self.latency = latency
+        self.jitter = jitter
+        self.settings = {'FREQ':27.2,'SLVL':1.0,'FMOD':0,'SRAT':10,'SEND':0}
+        self.queries = 0
+        self.reply = ''
+        self.ready = 0.0
+        self.extra = 0.0
+        self.traces = {1:1,2:2,3:3,4:4}
+        self.stored = np.zeros((2,0))
+        self.storing = False
+        self.store_start = time.time()
+        self.hp = {'F':'1','R':'A','Z':'1','N':'5','T':'1'}
+
+    def _fail(self):
+        if self.fail_rate and self.world.random.random_sample()<self.fail_rate:
+            raise OSError('Simulated bus timeout on {:s}'.format(self.address))
+
+    def _wait(self):
+        # A read blocks until the instrument has finished with the last command
+        delay = self.ready-time.time()
+        if delay>0:
+            time.sleep(delay)
+        self._fail()
+
+    def write(self,command,termination=None,**kwargs):
+        self._fail()
+        self.extra = 0.0
+        self.reply = self._answer(command)
+        delay = self.latency+self.jitter*self.world.gauss() if self.jitter else self.latency
+        self.ready = time.time()+max(delay,0.0)+self.extra
+
+    def read(self,**kwargs):
+        self._wait()
+        return self.reply
+
+    def read_raw(self,**kwargs):
+        self._wait()
+        return self.reply if isinstance(self.reply,bytes) else (self.reply+'\n').encode()
+
+    def query(self,command,**kwargs):
+        self.queries += 1
+        self.write(command)
+        return self.read()
+
+    def _lockin_values(self,X,Y):
+        # SR850 quantity codes, as used by SNAP? and TRCD
+        return {1:X,2:Y,3:np.hypot(X,Y),4:np.degrees(np.arctan2(Y,X)),9:self.settings['FREQ']}
+
+    def _store(self):
+        '''
+        Bring the SR850 data buffer up to date: points arrive every 1/rate
+        seconds after STRT, until PAUS (or the buffer fills, in one-shot mode).
+        '''
+        if not self.storing:
+            return
+        rate = 0.0625*2**int(self.settings['SRAT'])
+        total = int((time.time()-self.store_start)*rate)
+        if not self.settings['SEND']:
+            total = min(total,BUFFER_POINTS)
+        new = total-self.stored.shape[1]
+        if new<=0:
+            return
+        X,Y = self.world.lockin()
+        with self.world.lock:
+            scatter = 1.0+self.world.noise*self.world.random.normal(size=(2,new))
+        self.stored = np.hstack((self.stored,np.array([[X],[Y]])*scatter))
+        if self.settings['SEND']:
+            self.stored = self.stored[:,-BUFFER_POINTS:]
+
+    def _answer(self,command):
+        command = command.strip()
+        name,_,arg = command.partition(' ')
+        name = name.upper()
+        world = self.world
+        if name=='*IDN?':
+            return 'SIMULATED,{:s}'.format(self.address)
+        if ';' in command:
+            # Several queries in one transaction, answered in one reply
+            return ';'.join(self._answer(part) for part in command.split(';'))
+        if name=='SETP?':
+            return '{:+0.4f}'.format(world.T_end)
+        if name=='SETP':
+            world.set_target(float(arg.split(',')[-1]))
+            return ''
+        if name=='HTR?':
+            return '{:0.1f}'.format(world.heater())
+        if name=='KRDG?':
+            return '{:+0.4f}'.format(world.temperature())
+        if name=='SRDG?':
+            return '{:+0.4f}'.format(world.sensor(world.temperature()))
+        if name=='OUTP?':
+            values = self._lockin_values(*world.lockin())
+            return '{:0.6e}'.format(values[int(arg)])
+        if name=='SNAP?':
+            values = self._lockin_values(*world.lockin())
+            return ','.join('{:0.6e}'.format(values[int(code)]) for code in arg.split(','))
+        if name=='TRCD':
+            trace,quantity = [int(v) for v in arg.split(',')[:2]]
+            self.traces[trace] = quantity
+            return ''
+        if name=='SPTS?':
+            self._store()
+            return '{:d}'.format(self.stored.shape[1])
+        if name=='TRCB?':
+            # Binary transfer of 4 byte little-endian floats
+            self._store()
+            trace,start,count = [int(v) for v in arg.split(',')]
+            values = self._lockin_values(*self.stored[:,start:start+count])
+            return np.asarray(values[self.traces[trace]],dtype='<f4').tobytes()
+        if name.endswith('?') and name[:-1] in self.settings:
+            return '{:0.4f}'.format(self.settings[name[:-1]])
+        if name in self.settings:
+            self.settings[name] = float(arg)
+            return ''
+        if name=='STRT':
+            if not self.storing:
+                self.storing = True
+                self.store_start = time.time()-self.stored.shape[1]/(0.0625*2**int(self.settings['SRAT']))
+            return ''
+        if name=='PAUS':
+            self._store()
+            self.storing = False
+            return ''
+        if name=='REST':
+            self.stored = np.zeros((2,0))
+            self.storing = False
+            return ''
+        if HP_COMMAND.fullmatch(name):
+            return self._hp_answer(name)
+        raise ValueError('Simulated instrument cannot answer {:s}'.format(command))
+
+    def _hp_answer(self,command):
+        '''
+        HP3478A program string, e.g. F2RAZ1N4 (configure and read, in the
+        default internal trigger mode), F2R-1Z0N4T4 (configure, trigger held)
+        or T3 (single trigger). Autoranging, autozero and a change of
+        configuration each add one latency to the reading, as they slow the
+        real meter.
+        '''
+        codes = dict(HP_CODE.findall(command))
+        reconfigured = any(self.hp[k]!=v for k,v in codes.items() if k!='T')
+        self.hp.update(codes)
+        cost = int(reconfigured)+int(self.hp['R']=='A')+int(self.hp['Z']=='1')
+        self.extra = cost*self.latency
+        return '{:+0.5E}'.format(self.world.reference())
+
+    def before_close(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class sim_resource_manager:
+
+    def __init__(self,world=None,latency=0.05,jitter=0.01,fail_rate=0.0,replay=None,**kwargs):
+        '''
+        Drop-in for visa.ResourceManager.
+        args:
+            world -- model_world or replay_world shared by every resource,
+            default a new one built from kwargs (or from replay)
+            latency,jitter -- float seconds, or a dict of address to a
+            (latency,jitter) pair
+            fail_rate -- float probability of a simulated bus timeout per call
+            replay -- str, optional log file to replay
+            kwargs -- passed to model_world or replay_world
+        '''
+        if world is None:
+            world = replay_world(replay,**kwargs) if replay else model_world(**kwargs)
+        self.world = world
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+
+    def open_resource(self,address,**kwargs):
+        if isinstance(self.latency,dict):
+            latency,jitter = self.latency.get(address,(0.05,0.01))
+        else:
+            latency,jitter = self.latency,self.jitter
+        return sim_instrument(address,self.world,latency,jitter,self.fail_rate)
+
+    def list_resources(self):
+        return ()
+
+    def close(self):
+        pass
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:44:41 2026
+
+@author:rday
+
+Temperature stability from the statistics of the recent readings, rather than
+from a fixed hold time: the readings of a rolling time window are fitted with
+a straight line, and the temperature is settled once the fitted mean is
+within tolerance of the setpoint, the slope is flat and the scatter about the
+line is small. The running sums of the fit are updated as readings enter and
+leave the window, so each reading costs O(1).
+
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+class stability_detector:
+
+    def __init__(self,window=30.0,slope_tol=0.05,noise_tol=0.05,temp_tol=0.5,min_span=0.5,min_samples=5):
+        '''
+        args:
+            window -- float seconds of readings considered
+            slope_tol -- float largest drift of a settled temperature (K/min).
+            A fitted slope within two standard errors of it counts as flat,
+            since a short window cannot resolve a smaller drift
+            noise_tol -- float largest standard deviation of the readings about
+            the fitted line (K)
+            temp_tol -- float largest distance of the mean from the setpoint (K)
+            min_span -- float fraction of window the readings must cover before
+            the temperature can be judged settled
+            min_samples -- int fewest readings before the temperature can be
+            judged settled
+        '''
+        self.window = window
+        self.slope_tol = slope_tol
+        self.noise_tol = noise_tol
+        self.temp_tol = temp_tol
+        self.min_span = min_span
+        self.min_samples = min_samples
+        self.readings = deque()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget every reading, e.g. after a change of setpoint.
+        '''
+        self.readings.clear()
+        self.t0 = None
+        self.T0 = 0.0
+        self.since_rebuild = 0
+        self._zero()
+
+    def _zero(self):
+        self.n = 0
+        self.St = self.ST = self.Stt = self.STT = self.StT = 0.0
+
+    def _accumulate(self,t,T,sign):
+        self.n += sign
+        self.St += sign*t
+        self.ST += sign*T
+        self.Stt += sign*t*t
+        self.STT += sign*T*T
+        self.StT += sign*t*T
+
+    def add(self,t,T):
+        '''
+        Add a reading, and drop those older than the window.
+        args:
+            t -- float epoch seconds
+            T -- float temperature (K)
+        '''
+        if self.t0 is None:
+            # Sums are taken about the first reading, to limit cancellation
+            self.t0,self.T0 = t,T
+        t,T = t-self.t0,T-self.T0
+        self.readings.append((t,T))
+        self._accumulate(t,T,1)
+        while self.readings and self.readings[0][0]<t-self.window:
+            self._accumulate(*self.readings.popleft(),-1)
+        self.since_rebuild += 1
+        if self.since_rebuild>=16*len(self.readings):
+            # Rebuild the sums now and then (amortized O(1)), so that rounding
+            # errors from the subtractions cannot build up over a long run
+            self.since_rebuild = 0
+            self._zero()
+            for reading in self.readings:
+                self._accumulate(*reading,1)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def span(self):
+        return self.readings[-1][0]-self.readings[0][0] if self.readings else 0.0
+
+    def mean(self):
+        return self.T0+self.ST/self.n if self.n else np.nan
+
+    def slope(self):
+        '''
+        Slope of the fitted line (K/s).
+        '''
+        Sxx = self.Stt-self.St*self.St/self.n if self.n else 0.0
+        if Sxx<=0:
+            return np.nan
+        return (self.StT-self.St*self.ST/self.n)/Sxx
+
+    def slope_error(self):
+        '''
+        Standard error of the slope of the fitted line (K/s).
+        '''
+        Sxx = self.Stt-self.St*self.St/self.n if self.n else 0.0
+        if self.n<3 or Sxx<=0:
+            return np.nan
+        return self.noise()/np.sqrt(Sxx)
+
+    def noise(self):
+        '''
+        Standard deviation of the readings about the fitted line (K).
+        '''
+        if self.n<3:
+            return np.nan
+        Syy = self.STT-self.ST*self.ST/self.n
+        Sxx = self.Stt-self.St*self.St/self.n
+        Sxy = self.StT-self.St*self.ST/self.n
+        residual = Syy-Sxy*Sxy/Sxx if Sxx>0 else Syy
+        return np.sqrt(max(residual,0.0)/(self.n-2))
+
+    def status(self,setpoint):
+        '''
+        Dict of the statistics, and of whether each criterion is met.
+        args:
+            setpoint -- float temperature (K)
+        '''
+        mean,slope,noise = self.mean(),self.slope(),self.noise()
+        error = self.slope_error()
+        enough = self.n>=self.min_samples and self.span>=self.min_span*self.window
+        return {'mean':mean,
+                'slope':slope*60.0,
+                'slope_error':error*60.0,
+                'noise':noise,
+                'enough':enough,
+                'close':abs(mean-setpoint)<=self.temp_tol,
+                'flat':(abs(slope)-2.0*error)*60.0<=self.slope_tol,
+                'quiet':noise<=self.noise_tol}
+
+    def settled(self,setpoint):
+        '''
+        True once the readings of the window are close to setpoint, flat and
+        quiet.
+        '''
+        if self.n<self.min_samples or self.span<self.min_span*self.window:
+            return False
+        status = self.status(setpoint)
+        return status['close'] and status['flat'] and status['quiet']
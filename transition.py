@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""
+Created Sun 18 Oct 19:30:27 2026
+
+@author:rday
+
+Superconducting transition analysis. R(T) from one branch of a run is binned
+onto a uniform temperature grid (rt_analysis.bin_branch), smoothed and
+differentiated with a Savitzky-Golay filter, and the onset, midpoint and
+zero-resistance temperatures are read off the smoothed curve. tc_table runs
+this over a whole catalogue of runs in a process pool.
+
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import rt_analysis
+import load_data
+
+
+def savgol_coefficients(window,order,deriv=0,delta=1.0):
+    '''
+    Savitzky-Golay convolution coefficients, from the least-squares fit of a
+    polynomial of the given order over window (odd) points.
+    args:
+        window -- int odd number of points
+        order -- int polynomial order, < window
+        deriv -- int order of the derivative returned
+        delta -- float sample spacing
+    return:
+        numpy array of window coefficients, for use with np.convolve
+    '''
+    half = window//2
+    offsets = np.arange(-half,half+1,dtype=np.float64)
+    vander = offsets[:,None]**np.arange(order+1)
+    fit = np.linalg.pinv(vander)
+    factorial = np.prod(np.arange(1,deriv+1)) if deriv>0 else 1
+    return fit[deriv][::-1]*factorial/delta**deriv
+
+
+def savgol(values,window=11,order=2,deriv=0,delta=1.0):
+    '''
+    Savitzky-Golay smoothing (deriv=0) or differentiation of evenly spaced
+    values. The ends are padded by reflecting the data about its end points.
+    '''
+    values = np.asarray(values,dtype=np.float64)
+    window = window+1-window%2
+    window = min(window,len(values)-(1-len(values)%2))
+    if window<=order:
+        return np.gradient(values,delta) if deriv else values.copy()
+    half = window//2
+    padded = np.concatenate((2*values[0]-values[half:0:-1],values,2*values[-1]-values[-2:-half-2:-1]))
+    return np.convolve(padded,savgol_coefficients(window,order,deriv,delta),mode='valid')
+
+
+def _fill_gaps(x,y):
+    '''
+    Linearly interpolate over the empty (nan) bins of a binned curve.
+    '''
+    good = np.isfinite(y)
+    if good.sum()<2:
+        return y
+    return np.interp(x,x[good],y[good])
+
+
+def _crossing(T,R,level,below):
+    '''
+    Highest temperature, at or below index below, where R rises through level
+    (linear interpolation between grid points). nan if R never reaches it.
+    '''
+    under = np.flatnonzero(R[:below+1]<=level)
+    if not len(under):
+        return np.nan
+    i = under[-1]
+    if i>=len(T)-1 or R[i+1]==R[i]:
+        return T[i]
+    return T[i]+(level-R[i])*(T[i+1]-T[i])/(R[i+1]-R[i])
+
+
+def smoothed_rt(data,dT=0.05,window=11,order=2,direction=None,T_key='T',R_key='Rs',tmin=None,tmax=None):
+    '''
+    Smoothed R(T) and dR/dT on a uniform grid.
+    args:
+        data -- dict of column arrays, e.g. load_data.data_obj(fnm).data
+        dT -- float grid spacing (K)
+        window,order -- Savitzky-Golay window (grid points, odd) and order
+        direction -- int -1 to use the cooling branches, +1 heating, 0 all
+        data. By default the cooling branches are used if the run has any,
+        and the heating branches otherwise.
+        T_key,R_key -- keys of the temperature and resistance columns
+        tmin,tmax -- float, optional limits of the grid (K)
+    return:
+        T,R,dRdT -- numpy arrays on the grid
+    '''
+    T = np.asarray(data[T_key],dtype=np.float64)
+    R = np.asarray(data[R_key],dtype=np.float64)
+    if direction!=0:
+        branches = rt_analysis.split_branches(T)
+        if direction is None:
+            direction = -1 if any(sign<0 for _,_,sign in branches) else 1
+        keep = np.zeros(len(T),dtype=bool)
+        for start,stop,sign in branches:
+            if sign==direction:
+                keep[start:stop] = True
+        T,R = T[keep],R[keep]
+    if tmin is not None or tmax is not None:
+        keep = (T>=(tmin if tmin is not None else -np.inf))&(T<=(tmax if tmax is not None else np.inf))
+        T,R = T[keep],R[keep]
+    if len(T)<2:
+        return np.zeros(0),np.zeros(0),np.zeros(0)
+    edges = np.arange(T.min(),T.max()+dT,dT)
+    binned = rt_analysis.bin_branch(T,R,edges)
+    grid = binned['T']
+    Rgrid = _fill_gaps(grid,binned['mean'])
+    return grid,savgol(Rgrid,window,order),savgol(Rgrid,window,order,deriv=1,delta=dT)
+
+
+def _peak_transition(T,R,dRdT,peak,onset,midpoint,zero,reach,sharpness):
+    '''
+    Transition centred on one peak of dR/dT, if it is one.
+    return:
+        (drop,result) -- float fall of R (Ohm) through the transition, and
+        the dict of find_transition; or None if the peak is not a transition
+    '''
+    top = dRdT[peak]
+    half = dRdT>=0.5*top
+    lo = max(peak-(np.flatnonzero(~half[:peak+1][::-1])[0] if not half[:peak+1].all() else peak),0)
+    hi = min(peak+(np.flatnonzero(~half[peak:])[0] if not half[peak:].all() else len(T)-1-peak),len(T)-1)
+    width = T[hi]-T[lo]
+    # Rn is taken just above the peak, not up the slope of the normal state
+    above = np.flatnonzero(dRdT[hi:]<0.25*top)
+    upper = min(hi+(above[0] if len(above) else len(T)-1-hi),hi+(hi-lo),len(T)-1)
+    Rn = R[upper]
+    # A metal has T*dR/dT/R below about 2 (1 for R linear in T)
+    if not top*T[peak]>sharpness*Rn:
+        return None
+    result = {'T_peak':T[peak],
+              'width':width,
+              'Rn':Rn,
+              'dRdT_max':top,
+              'Tc_onset':_crossing(T,R,onset*Rn,upper),
+              'Tc_mid':_crossing(T,R,midpoint*Rn,upper),
+              'Tc_zero':_crossing(T,R,zero*Rn,upper)}
+    if not result['Tc_onset']-T[peak]<=reach*width:
+        return None
+    drop = Rn-R[max(peak-int(reach*(hi-lo)),0):peak+1].min()
+    if np.isfinite(result['Tc_mid']):
+        # R must fall to the midpoint close to the peak, and stay down below
+        # it: a glitch dips and comes back up
+        if T[peak]-result['Tc_mid']>reach*width:
+            return None
+        if (R[:np.searchsorted(T,result['Tc_mid'])]>onset*Rn).any():
+            return None
+        return drop,result
+    # The run ends part way down the transition
+    if T[peak]-T[0]<=reach*width and not (R[:peak]>onset*Rn).any():
+        return drop,result
+    return None
+
+
+def find_transition(data,onset=0.9,midpoint=0.5,zero=0.01,reach=5.0,sharpness=2.0,**kwargs):
+    '''
+    Locate the superconducting transition of a run. Each peak of dR/dT is a
+    candidate. Its normal-state resistance Rn is the smoothed resistance just
+    above the peak, where dR/dT has fallen back below a quarter of its peak
+    value (at most one peak width above the upper half maximum). The onset,
+    midpoint and zero-resistance temperatures are where R first reaches the
+    given fractions of Rn on the way down.
+    A peak is a transition if it is sharper than the slope of a metal, if R
+    falls to onset*Rn within reach peak widths above it and to midpoint*Rn
+    within reach widths below it, and if R stays below onset*Rn further
+    down; a run that ends part way down the transition, within reach widths
+    of the peak, gives the onset alone. Of the transitions found, the one
+    with the largest fall of R is returned, and a run that never goes
+    superconducting gives nan throughout.
+    args:
+        data -- dict of column arrays, e.g. load_data.data_obj(fnm).data
+        onset,midpoint,zero -- float fractions of Rn
+        reach -- float widths of the dR/dT peak within which R must reach
+        onset*Rn above T_peak and midpoint*Rn below it
+        sharpness -- float smallest T*dR/dT/Rn at the peak
+        kwargs -- passed to smoothed_rt
+    return:
+        dict with 'Tc_onset', 'Tc_mid', 'Tc_zero', 'T_peak' (K), 'width'
+        (K, full width at half maximum of the dR/dT peak), 'Rn' and
+        'dRdT_max'. Features that the data does not reach are nan.
+    '''
+    result = {'Tc_onset':np.nan,'Tc_mid':np.nan,'Tc_zero':np.nan,'T_peak':np.nan,'width':np.nan,'Rn':np.nan,'dRdT_max':np.nan}
+    T,R,dRdT = smoothed_rt(data,**kwargs)
+    if len(T)<3:
+        return result
+    slope = np.where(np.isfinite(dRdT),dRdT,-np.inf)
+    padded = np.concatenate(([-np.inf],slope,[-np.inf]))
+    peaks = np.flatnonzero((slope>0)&(slope>=padded[:-2])&(slope>=padded[2:]))
+    best = None
+    for peak in peaks:
+        found = _peak_transition(T,R,dRdT,peak,onset,midpoint,zero,reach,sharpness)
+        if found is not None and (best is None or found[0]>best[0]):
+            best = found
+    if best is not None:
+        result.update(best[1])
+    return result
+
+
+def _run_transition(job):
+    name,data,kwargs = job
+    if data is None:
+        data = load_data.data_obj(name).data
+    result = find_transition(data,**kwargs)
+    result['file'] = name
+    return result
+
+
+def tc_table(runs,processes=None,**kwargs):
+    '''
+    Transition temperatures for many runs, computed in a pool of worker
+    processes. On Windows, call this from under if __name__ == "__main__".
+    args:
+        runs -- list of file names, or a catalogue from load_data.load_runs
+        (duplicate entries in a catalogue are skipped)
+        processes -- int number of worker processes, default os.cpu_count()
+        kwargs -- passed to find_transition
+    return:
+        list of dict, one per run, as returned by find_transition with 'file'
+    '''
+    jobs = []
+    for run in runs:
+        if isinstance(run,dict):
+            if run.get('duplicate_of') is None:
+                jobs.append((run['file'],{k:np.asarray(v) for k,v in run['data'].items()},kwargs))
+        else:
+            jobs.append((run,None,kwargs))
+    if processes==1 or len(jobs)<2:
+        return [_run_transition(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_run_transition,jobs))
@@ -16,15 +16,28 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.ticker import FormatStrFormatter
 import numpy as np
 import datetime
+import queue
 import tkinter as Tk
 from tkinter import filedialog
 
 import machines
+import downsample
+import logfile
+import columns
+import acquisition
 
 
 class interface:
 
-    def __init__(self):
+    def __init__(self,history_length=None,stats_file=None):
+        '''
+        args:
+            history_length -- int, optional: keep only this many of the most
+            recent samples in memory (as a ring buffer) for the live display.
+            The log file always receives every sample.
+            stats_file -- str, optional: on quitting, write the bus latency
+            statistics here (JSON)
+        '''
         self.running = False
         #        self.sample,self.user,self.material,self.Rr,self.amplification = self._get_info()
 
@@ -38,13 +51,22 @@ class interface:
         self.voltmeter = machines.HP3478A(9)
         self.lakeshore = machines.LS331(15,'A')
         self.lockin = machines.SR850(8,27.2,1.0)
-        self.Ts = []
-        self.reVs = []
-        self.imVs = []
-        self.Vr = []
-        self.Rs = []
-        self.time = []
+        self.engine = acquisition.acquisition_engine({'T':(self.lakeshore._request_T,self.lakeshore._fetch_T),
+                                                      'Vr':(self.voltmeter._start_acv,self.voltmeter._fetch_reading),
+                                                      'Vs':(self.lockin._request_V,self.lockin._fetch_V)},timeout=5.0)
+        self.samples = queue.Queue()
+        self.sampler = acquisition.sampler(self.engine,5.0,self.samples)
+        self.frame_interval = 250
+        self.history = columns.column_store(['time','Ts','reVs','imVs','Vr','Rs','spread'],ring=history_length)
         self.recur_id = None
+        self.max_points = downsample.MAX_POINTS
+        self.blit = True
+        self.lines = []
+        self.background = None
+        self.writer = None
+        self.log_options = {'flush_lines':10,'flush_interval':10.0,'fsync':'flush'}
+        self.timing = acquisition.tick_timer()
+        self.stats_file = stats_file
 
         self.plot_make()
 
@@ -60,43 +82,72 @@ class interface:
         '''
         return Vs/self.amplification*self.Rr/Vr
     
-    def _add_data(self,Ts,Vs,Vr):
-        timediff = (datetime.datetime.now()-self.start).total_seconds()
-        self.time.append(float(timediff))
-        self.Ts.append(Ts)
-        self.imVs.append(np.imag(Vs))
-        self.reVs.append(np.real(Vs))
-        self.Vr.append(Vr)
-        self.Rs.append(self._V_to_R(Vr,abs(Vs)))
+    def _add_data(self,Ts,Vs,Vr,stamp=None,spread=0.0):
+        '''
+        Add a sample to the history, a column_store of float64 arrays.
+        args:
+            Ts,Vs,Vr -- float temperature, complex sample voltage, float
+            reference voltage
+            stamp -- float epoch seconds of the sample, default now
+            spread -- float seconds between the instrument reads
+        '''
+        if stamp is None:
+            timediff = (datetime.datetime.now()-self.start).total_seconds()
+        else:
+            timediff = stamp-self.start.timestamp()
+        self.history.append(time=timediff,Ts=Ts,reVs=np.real(Vs),imVs=np.imag(Vs),Vr=Vr,Rs=self._V_to_R(Vr,abs(Vs)),spread=spread)
+    
     
+    def drain_samples(self):
+        '''
+        Take every sample waiting in the queue from the sampler thread, add
+        it to the history and write it to the log.
+        return:
+            int number of samples added
+        '''
+        added = 0
+        while True:
+            try:
+                sample = self.samples.get_nowait()
+            except queue.Empty:
+                return added
+            if sample['errors']:
+                for name,err in sample['errors'].items():
+                    print('WARNING: {:s} read failed: {:s}'.format(name,str(err)))
+                continue
+            self.timing.add('instrument',sample['duration'])
+            with self.timing.phase('compute'):
+                T = sample['values']['T']
+                Vr = sample['values']['Vr']
+                Vs_x,Vs_y = sample['values']['Vs']
+                Vs = Vs_x + 1.0j*Vs_y
+                self._add_data(T,Vs,Vr,sample['time'],sample['spread'])
+            with self.timing.phase('disk'):
+                self.write_dataline(-1)
+            self.timing.tick()
+            added += 1
     
     def write_header(self):
-        
-        with open(self.fnm,'w') as tofile:
-            self.start = datetime.datetime.now()
-            tofile.write('UBC Resistivity Measurement:')
-            tofile.write(str(self.start))
-            tofile.write('\n')
-            tofile.write('==========================================================================\n')
-            tofile.write('Sample Name: {:s}\n'.format(self.sample))
-            tofile.write('User: {:s}\n'.format(self.user))
-            tofile.write('Material: {:s}\n'.format(self.material))
-            tofile.write('==========================================================================\n')
-            tofile.write('  Time(s)  |   Temp(K)   |  Vref(V)  |  ReVs (mV)  |  ImVs (mV)  |  Res(Ohm)  \n')
-            tofile.write('==========================================================================\n')
-            
-            
-        tofile.close()
+        '''
+        Start a new log file. The file is then held open by self.writer until
+        the run is closed, with lines buffered and flushed in blocks.
+        '''
+        self.close_log()
+        self.start = datetime.datetime.now()
+        self.writer = logfile.log_writer(self.fnm,**self.log_options)
+        self.writer.write_header(self.start,self.sample,self.user,self.material)
     
     def write_dataline(self,index):
         v = index
-        with open(self.fnm,'a') as tofile:
-            line = '  {:0.05f}  |  {:0.05f}  |  {:0.05f}  |   {:0.05f}   |   {:0.05f}    |  {:0.05f}  \n'.format(self.time[v],self.Ts[v],self.Vr[v],self.reVs[v]*1000,self.imVs[v]*1000,self.Rs[v])
-            tofile.write(line)
-        tofile.close()
-                
-            
-        
+        if self.writer is None:
+            self.writer = logfile.log_writer(self.fnm,append=True,**self.log_options)
+        h = self.history
+        self.writer.write_line(h['time'][v],h['Ts'][v],h['Vr'][v],h['reVs'][v],h['imVs'][v],h['Rs'][v])
+
+    def close_log(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
     
 
 
@@ -110,14 +161,82 @@ class interface:
         return fig1,ax1,ax2,ax3
 
     def update_figure(self,fig,axes):
+        '''
+        Redraw the live plots. In blit mode (the default), the lines are
+        created once and only their data is replaced on each tick; the axes
+        are rescaled, with a full redraw, only when the data leaves the current
+        view, and otherwise the three lines are blitted onto the saved
+        background, so each tick costs about the same however long the run.
+        Set self.blit = False for a full redraw on every tick.
+        '''
+        if not self.blit:
+            self._redraw_figure(fig,axes)
+            return
+        if not self.lines:
+            self._init_figure(fig,axes)
+        time = self.history['time']
+        plottables = [self.history['Ts'],self.history['Rs'],self.history['Vr']]
+        rescale = False
+        for ax,line,y in zip(axes,self.lines,plottables):
+            x,y = downsample.minmax(time,y,self.max_points)
+            line.set_data(x,y)
+            if len(x) and self._outside_view(ax,x,y):
+                self._rescale(ax,x,y)
+                rescale = True
+        if rescale or self.background is None:
+            fig.canvas.draw()
+        else:
+            fig.canvas.restore_region(self.background)
+            for ax,line in zip(axes,self.lines):
+                ax.draw_artist(line)
+            fig.canvas.blit(fig.bbox)
+        
+    def _init_figure(self,fig,axes):
+        '''
+        Create the (animated) lines once, and save the static background of
+        the figure whenever it is fully redrawn, e.g. after a resize.
+        '''
+        cols = ['red','blue','black']
+        self.lines = []
+        for ax,col in zip(axes,cols):
+            line, = ax.plot([],[],c=col,animated=True)
+            self.lines.append(line)
+        
+        def _on_draw(event):
+            self.background = fig.canvas.copy_from_bbox(fig.bbox)
+            for ax,line in zip(axes,self.lines):
+                ax.draw_artist(line)
+        
+        fig.canvas.mpl_connect('draw_event',_on_draw)
+    
+    def _outside_view(self,ax,x,y):
+        xlo,xhi = ax.get_xlim()
+        ylo,yhi = ax.get_ylim()
+        return x[0]<xlo or x[-1]>xhi or y.min()<ylo or y.max()>yhi
+    
+    def _rescale(self,ax,x,y):
+        '''
+        Grow the view to hold the data with some headroom, so that rescaling
+        (and the full redraw it needs) happens rarely: the time axis extends
+        to 1.5 times the elapsed time, and the y axis is padded by 10%.
+        '''
+        span = max(x[-1]-x[0],1.0)
+        ax.set_xlim(x[0],x[0]+1.5*span)
+        lo,hi = y.min(),y.max()
+        pad = 0.1*(hi-lo) if hi>lo else 0.1*abs(hi) or 1.0
+        ax.set_ylim(lo-pad,hi+pad)
+
+    def _redraw_figure(self,fig,axes):
         self.lines = []
-        plottables = [self.Ts,self.Rs,self.Vr]
+        time = self.history['time']
+        plottables = [self.history['Ts'],self.history['Rs'],self.history['Vr']]
         cols = ['red','blue','black']
         for ai in list(enumerate(axes)):
             ai[1].cla()
-            tmp, = ai[1].plot(self.time,plottables[ai[0]],c=cols[ai[0]])
-            if len(self.time)>=2:
-                ai[1].set_xlim(self.time[0],self.time[-1])
+            x,y = downsample.minmax(time,plottables[ai[0]],self.max_points)
+            tmp, = ai[1].plot(x,y,c=cols[ai[0]])
+            if len(time)>=2:
+                ai[1].set_xlim(time[0],time[-1])
 
             self.lines.append(tmp)
 
@@ -159,19 +278,36 @@ class interface:
 
         def _run():
             self.running = True
-            self.root.after(1000*int(Ibox.get()),task)
+            self.sampler.interval = float(Ibox.get())
+            self.sampler.start()
+            self.recur_id = self.root.after(self.frame_interval,task)
             run_button['state']='disabled'
             stop_button['state']='normal'
 
         def _stop():
             self.running = False
+            self.sampler.stop()
             self.root.after_cancel(self.recur_id)
             self.recur_id = None
+            task(reschedule=False)
+            if self.writer is not None:
+                self.writer.flush()
+            print(self.timing.report())
+            print(machines.sessions.stats.report())
             stop_button['state']='disabled'
             run_button['state']='normal'
             
             
         def _quit():
+            self.sampler.stop()
+            if self.recur_id is not None:
+                self.root.after_cancel(self.recur_id)
+            # Log the samples still queued by the sampler before closing
+            self.drain_samples()
+            self.close_log()
+            self.engine.close()
+            if self.stats_file is not None:
+                machines.sessions.dump_stats(self.stats_file)
             self.lakeshore._disconnect()
             self.voltmeter._disconnect()
             self.lockin._disconnect()
@@ -205,15 +341,16 @@ class interface:
         Tk.Label(master=self.root,text='Time (s)',background='white').grid(row=7,column=7)
         
         
-        def task():
-            T = self.lakeshore._measure_T()
-            Vr = self.voltmeter._do_acv_measure()
-            Vs_x,Vs_y = self.lockin._measure_V()
-            Vs = Vs_x + 1.0j*Vs_y
-            self._add_data(T,Vs,Vr)
-            self.write_dataline(-1)
-            self.update_figure(fig1,(ax1,ax2,ax3))
-            self.recur_id = self.root.after(int(1000*float(Ibox.get())),task)
+        def task(reschedule=True):
+            '''
+            GUI side of the acquisition: drain the samples queued by the
+            sampler thread, log them, and redraw once per frame.
+            '''
+            if self.drain_samples():
+                with self.timing.phase('redraw'):
+                    self.update_figure(fig1,(ax1,ax2,ax3))
+            if reschedule:
+                self.recur_id = self.root.after(self.frame_interval,task)
            
         
         Tk.mainloop()